@@ -0,0 +1,127 @@
+from datetime import timedelta
+
+from sqlalchemy import update, delete, insert, func, literal, select
+from sqlalchemy.orm import Session
+
+from .dialects import utcnow
+from .models import User, ChangeLog
+
+
+# Tombstones older than this are dropped, clients with an older cursor must resync from scratch
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+ENTITY_DECK = "deck"
+ENTITY_CARD = "card"
+ENTITY_SCHEDULE = "schedule"
+
+OP_UPSERT = "upsert"
+OP_DELETE = "delete"
+
+
+def _allocate_seqs(db: Session, user_id: int, count: int) -> int:
+    # Row lock on the user serializes writers until commit, so a user's
+    # sequence numbers become visible in the order they were handed out
+    last = db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(change_seq=User.change_seq + count)
+        .returning(User.change_seq)
+    ).scalar_one()
+    return last - count + 1
+
+
+def _compact_tombstones(db: Session, user_id: int):
+    expired = db.execute(
+        delete(ChangeLog)
+        .where(
+            ChangeLog.user_id == user_id,
+            ChangeLog.op == OP_DELETE,
+            ChangeLog.created_at < utcnow(-TOMBSTONE_RETENTION),
+        )
+        .returning(ChangeLog.seq)
+    ).scalars().all()
+
+    # Cursors at or before the newest dropped tombstone can no longer sync incrementally
+    if expired:
+        db.execute(
+            update(User)
+            .where(User.id == user_id, User.sync_floor_seq < max(expired))
+            .values(sync_floor_seq=max(expired))
+        )
+
+
+def record_changes(db: Session, user_id: int, entity: str, entity_ids: list[int], op: str, deck_id: int | None = None):
+    if not entity_ids:
+        return
+
+    first_seq = _allocate_seqs(db, user_id, len(entity_ids))
+
+    # Only the newest entry per entity matters, drop the ones it supersedes.
+    # A card tombstone also covers its schedule.
+    superseded = [entity]
+    if entity == ENTITY_CARD and op == OP_DELETE:
+        superseded.append(ENTITY_SCHEDULE)
+    db.execute(
+        delete(ChangeLog).where(
+            ChangeLog.user_id == user_id,
+            ChangeLog.entity.in_(superseded),
+            ChangeLog.entity_id.in_(entity_ids),
+        )
+    )
+
+    # A deck tombstone covers every card and schedule in the deck
+    if entity == ENTITY_DECK and op == OP_DELETE:
+        db.execute(
+            delete(ChangeLog).where(
+                ChangeLog.user_id == user_id,
+                ChangeLog.deck_id.in_(entity_ids),
+                ChangeLog.entity.in_([ENTITY_CARD, ENTITY_SCHEDULE]),
+            )
+        )
+
+    db.execute(
+        insert(ChangeLog),
+        [
+            {
+                "user_id": user_id,
+                "seq": first_seq + offset,
+                "entity": entity,
+                "entity_id": entity_id,
+                "op": op,
+                "deck_id": deck_id,
+            }
+            for offset, entity_id in enumerate(entity_ids)
+        ],
+    )
+
+    if op == OP_DELETE:
+        _compact_tombstones(db, user_id)
+
+
+def record_change(db: Session, user_id: int, entity: str, entity_id: int, op: str, deck_id: int | None = None):
+    record_changes(db, user_id, entity, [entity_id], op, deck_id)
+
+
+def record_new_entities(db: Session, user_id: int, entity: str, entity_ids, count: int, deck_id: int):
+    # Upserts for freshly inserted rows, entity_ids is a one-column select of exactly count ids.
+    # Nothing older can be superseded, so the entries are written by one INSERT ... SELECT
+    # instead of sending every id from the application.
+    if not count:
+        return
+
+    first_seq = _allocate_seqs(db, user_id, count)
+    ids = entity_ids.subquery()
+    entity_id = list(ids.c)[0]
+    db.execute(
+        insert(ChangeLog).from_select(
+            ["user_id", "seq", "entity", "entity_id", "op", "deck_id"],
+            select(
+                literal(user_id),
+                literal(first_seq - 1) + func.row_number().over(order_by=entity_id),
+                literal(entity),
+                entity_id,
+                literal(OP_UPSERT),
+                literal(deck_id),
+            ),
+        )
+    )
@@ -0,0 +1,110 @@
+from sqlalchemy import func, insert, literal, select, text
+from sqlalchemy.orm import Session
+
+from .dialects import dialect_name
+from .models import Deck, Card, CardSchedule
+from .changelog import ENTITY_CARD, ENTITY_SCHEDULE, record_new_entities
+
+
+CARD_COLUMNS = ["id", "deck_id", "front", "back", "is_learned"]
+
+# Room for the search index entries of a large clone, see _clone_postgresql
+CLONE_GIN_PENDING_LIST_LIMIT = "64MB"
+
+# Carried over with the schedule. Leases belong to the source deck's devices and are not.
+SCHEDULE_COLUMNS = ["repetition_count", "interval_days", "ease_factor", "next_review_at", "last_reviewed_at"]
+
+
+def _clone_postgresql(db: Session, source_id: int, deck_id: int, carry: bool) -> int:
+    # New ids are drawn from the cards sequence up front, giving an old -> new id map
+    # that the schedule copy joins on. All in one statement.
+    ordered = select(Card.id, Card.front, Card.back, Card.is_learned).where(Card.deck_id == source_id).order_by(Card.id).subquery()
+    id_map = (
+        select(
+            ordered.c.id,
+            ordered.c.front,
+            ordered.c.back,
+            ordered.c.is_learned,
+            # Sequence looked up once, not per row
+            func.nextval(select(func.pg_get_serial_sequence(Card.__tablename__, "id")).scalar_subquery()).label("new_id"),
+        )
+        .cte("id_map")
+    )
+
+    copied_cards = (
+        insert(Card)
+        .from_select(
+            CARD_COLUMNS,
+            select(id_map.c.new_id, literal(deck_id), id_map.c.front, id_map.c.back, id_map.c.is_learned if carry else literal(False)),
+        )
+        .cte("copied_cards")
+    )
+    statement = select(func.count()).select_from(id_map).add_cte(copied_cards)
+
+    if carry:
+        copied_schedules = (
+            insert(CardSchedule)
+            .from_select(
+                ["card_id", "deck_id", "is_carried", *SCHEDULE_COLUMNS],
+                select(id_map.c.new_id, literal(deck_id), literal(True), *(getattr(CardSchedule, c) for c in SCHEDULE_COLUMNS))
+                .join_from(CardSchedule, id_map, CardSchedule.card_id == id_map.c.id),
+            )
+            .cte("copied_schedules")
+        )
+        statement = statement.add_cte(copied_schedules)
+
+    # Most of the copy's cost is the search GIN index. A larger pending list for this
+    # transaction queues the new entries instead of merging them into the index inline,
+    # the merge happens later in vacuum.
+    db.execute(text(f"SET LOCAL gin_pending_list_limit = '{CLONE_GIN_PENDING_LIST_LIMIT}'"))
+    return db.execute(statement).scalar_one()
+
+
+def _clone_sqlite(db: Session, source_id: int, deck_id: int, carry: bool) -> int:
+    # No DML in CTEs. The request holds the write lock, so ids are handed out in
+    # insertion order without gaps and the nth source card becomes the nth new card.
+    copied = db.execute(
+        insert(Card).from_select(
+            CARD_COLUMNS[1:],
+            select(literal(deck_id), Card.front, Card.back, Card.is_learned if carry else literal(False))
+            .where(Card.deck_id == source_id)
+            .order_by(Card.id),
+        )
+    ).rowcount
+
+    if carry and copied:
+        # AUTOINCREMENT ids of one INSERT ... SELECT are consecutive, so the
+        # old -> new id map is the source card's position plus the first new id
+        first_id = db.execute(select(func.min(Card.id)).where(Card.deck_id == deck_id)).scalar_one()
+        id_map = (
+            select(Card.id, (literal(first_id - 1) + func.row_number().over(order_by=Card.id)).label("new_id"))
+            .where(Card.deck_id == source_id)
+            .subquery("id_map")
+        )
+        db.execute(
+            insert(CardSchedule).from_select(
+                ["card_id", "deck_id", "is_carried", *SCHEDULE_COLUMNS],
+                select(id_map.c.new_id, literal(deck_id), literal(True), *(getattr(CardSchedule, c) for c in SCHEDULE_COLUMNS))
+                .join_from(id_map, CardSchedule, CardSchedule.card_id == id_map.c.id),
+            )
+        )
+    return copied
+
+
+def clone_deck(db: Session, user_id: int, source: Deck, name: str, carry: bool) -> tuple[Deck, int]:
+    # Copies the cards (and with carry, their schedules) inside the database, the rows
+    # never travel through the application. Returns the new deck and the number of cards.
+    deck = Deck(name=name, user_id=user_id)
+    db.add(deck)
+    db.flush()
+
+    if dialect_name(db) == "sqlite":
+        copied = _clone_sqlite(db, source.id, deck.id, carry)
+    else:
+        copied = _clone_postgresql(db, source.id, deck.id, carry)
+
+    record_new_entities(db, user_id, ENTITY_CARD, select(Card.id).where(Card.deck_id == deck.id), copied, deck.id)
+    if carry:
+        scheduled = db.query(func.count()).filter(CardSchedule.deck_id == deck.id).scalar()
+        record_new_entities(db, user_id, ENTITY_SCHEDULE, select(CardSchedule.card_id).where(CardSchedule.deck_id == deck.id), scheduled, deck.id)
+    return deck, copied
@@ -13,8 +13,48 @@ ENV = os.getenv("ENV", "prod")
 DATABASE_URL = get_env_variable("DATABASE_URL")
 JWT_SECRET_KEY = get_env_variable("JWT_SECRET_KEY")
 
+# Connection pool per process (SQLAlchemy's defaults). The serve CLI sets these from its global budget.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Optional comma separated read replica urls. GET requests are spread across them.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# After a client's write, its reads stay on the primary for this many seconds (read-your-writes, via a cookie)
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+
+# Spread long intervals across lighter nearby days. Reviews then take the ORM write path.
+SCHEDULE_FUZZ_ENABLED = os.getenv("SCHEDULE_FUZZ_ENABLED", "0") == "1"
+
+# "cte" reviews in a single statement on Postgres, "orm" keeps the lock/compute/flush round trips
+REVIEW_WRITE_PATH = os.getenv("REVIEW_WRITE_PATH", "cte")
+
+# Review history durability. "sync" inserts it in the review's transaction. "group" and "async"
+# write it behind the schedule update in batches of up to HISTORY_FLUSH_MAX_ROWS, flushed at least
+# every HISTORY_FLUSH_INTERVAL_SECONDS. "group" responds once the batch is committed, "async" right away.
+REVIEW_HISTORY_DURABILITY = os.getenv("REVIEW_HISTORY_DURABILITY", "sync")
+HISTORY_FLUSH_MAX_ROWS = int(os.getenv("HISTORY_FLUSH_MAX_ROWS", "200"))
+HISTORY_FLUSH_INTERVAL_SECONDS = float(os.getenv("HISTORY_FLUSH_INTERVAL_SECONDS", "0.02"))
+
+# Rate limiting and admission control. Backend is "memory" (per worker) or "database" (shared).
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+# Connections the database backend holds per process, next to the request pool
+RATE_LIMIT_POOL_SIZE = 2
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "200"))
+ADMISSION_MAX_POOL_WAITERS = int(os.getenv("ADMISSION_MAX_POOL_WAITERS", "20"))
+
+# Opt-in request profiling. Requests carrying "X-Profile: <PROFILE_TOKEN>" are always profiled,
+# others with probability PROFILE_SAMPLE_RATE. Output goes to PROFILE_DIR. Off when both are unset.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
 # Test url can be none if in production instead of dev environment.
 TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
 
+# Optional second Postgres instance standing in for a replica in tests
+TEST_REPLICA_DATABASE_URL = os.getenv("TEST_REPLICA_DATABASE_URL")
+
 # JWT_ALGORITHM = os.environ.get("JWT_ALGORITHM", "HS256")
 # JWT_EXPIRE_MINUTES = int(os.environ.get("JWT_EXPIRE_MINUTES", 60))
\ No newline at end of file
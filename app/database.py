@@ -1,15 +1,155 @@
-from .config import DATABASE_URL
-from sqlalchemy import create_engine
+from .config import DATABASE_URL, DATABASE_REPLICA_URLS, REPLICA_STICKY_SECONDS, DB_POOL_SIZE, DB_MAX_OVERFLOW
+from .dialects import search_text
+from .security import client_key
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import StaticPool
+from fastapi import Request, Response
 
+import itertools
+import math
+import time
 
-engine = create_engine(DATABASE_URL)
+
+def _sqlite_on_connect(dbapi_connection, connection_record):
+    # Leave transactions to SQLAlchemy (see _sqlite_on_begin), pysqlite's own
+    # handling would defer every lock until the first write
+    dbapi_connection.isolation_level = None
+
+    cursor = dbapi_connection.cursor()
+    # Readers keep going while a writer commits, NORMAL sync is crash safe under WAL
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    # Deletes rely on ON DELETE CASCADE
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+    # Word splitting for card search, SQLite has no full-text column to match against
+    dbapi_connection.create_function("search_text", 1, search_text, deterministic=True)
+
+
+def _sqlite_on_begin(conn):
+    # SQLite has no row locks. Write sessions begin IMMEDIATE and take the database
+    # write lock up front, which serializes them the way FOR UPDATE would.
+    conn.exec_driver_sql(f"BEGIN {conn.get_execution_options().get('sqlite_begin', 'DEFERRED')}")
+
+
+def create_db_engine(url: str, **kwargs) -> Engine:
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite":
+        return create_engine(url, **kwargs)
+
+    # Sessions are used from FastAPI's thread pool
+    kwargs.setdefault("connect_args", {})["check_same_thread"] = False
+
+    # An in-memory database only exists on its one connection
+    if url.database in (None, "", ":memory:"):
+        kwargs.pop("pool_size", None)
+        kwargs.pop("max_overflow", None)
+        kwargs["poolclass"] = StaticPool
+
+    engine = create_engine(url, **kwargs)
+    event.listen(engine, "connect", _sqlite_on_connect)
+    event.listen(engine, "begin", _sqlite_on_begin)
+    return engine
+
+
+def pool_status(bind: Engine) -> dict:
+    # Static and singleton pools (in-memory SQLite) have no counters
+    pool = bind.pool
+    if not hasattr(pool, "checkedout"):
+        return {"class": type(pool).__name__}
+    return {
+        "size": pool.size(),
+        "max_overflow": max(getattr(pool, "_max_overflow", 0), 0),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+    }
+
+
+engine = create_db_engine(DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+# Sessions for write requests. Only SQLite reads the option, Postgres locks rows as it goes.
+WriteSessionLocal = sessionmaker(bind=engine.execution_options(sqlite_begin="IMMEDIATE"), autocommit=False, autoflush=False)
+
+# Read replicas are optional, pre-ping so a replica restart doesn't surface as a failed read
+replica_engines = [create_db_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=True) for url in DATABASE_REPLICA_URLS]
+ReplicaSessionLocals = [sessionmaker(bind=replica, autocommit=False, autoflush=False) for replica in replica_engines]
+
+READ_METHODS = {"GET", "HEAD"}
+
+# Time of the client's last write. Held by the client so the read that follows is
+# routed the same way by whichever worker (or server) it lands on.
+LAST_WRITE_COOKIE = "last_write"
+
+
+class ReplicaRouter:
+    # marks is the rate limiter's backend (mark/marked_at), where last writes are kept
+    # per client so stickiness doesn't depend on the cookie coming back
+    def __init__(self, primary: sessionmaker, replicas: list[sessionmaker], sticky_seconds: float, write_primary: sessionmaker | None = None, marks=None):
+        self.primary = primary
+        self.write_primary = write_primary or primary
+        self.replicas = replicas
+        self.sticky_seconds = sticky_seconds
+        self.marks = marks
+        self._round_robin = itertools.count()
+
+    def mark_write(self, client: str):
+        # Bearer-token clients often drop cookies, and WebSocket messages can't set them
+        if self.replicas and self.marks is not None:
+            self.marks.mark(f"write:{client}")
+
+    def _is_sticky(self, request: Request) -> bool:
+        try:
+            if time.time() - float(request.cookies.get(LAST_WRITE_COOKIE, "")) < self.sticky_seconds:
+                return True
+        except ValueError:
+            pass
+        if self.marks is None:
+            return False
+        marked_at = self.marks.marked_at(f"write:{client_key(request)}")
+        return marked_at is not None and time.time() - marked_at < self.sticky_seconds
+
+    def get_db(self, request: Request, response: Response):
+        is_write = request.method not in READ_METHODS
+
+        # Writes, and reads shortly after this client's own write, go to the primary
+        if is_write:
+            db = self.write_primary()
+        elif not self.replicas or self._is_sticky(request):
+            db = self.primary()
+        else:
+            db = self.replicas[next(self._round_robin) % len(self.replicas)]()
+
+        # The window counts from the start of the write, writes take milliseconds next to it
+        if is_write and self.replicas:
+            self.mark_write(client_key(request))
+            response.set_cookie(
+                LAST_WRITE_COOKIE,
+                str(time.time()),
+                max_age=math.ceil(self.sticky_seconds),
+                httponly=True,
+                samesite="lax",
+            )
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+router = ReplicaRouter(SessionLocal, ReplicaSessionLocals, REPLICA_STICKY_SECONDS, WriteSessionLocal)
+
+def get_db(request: Request, response: Response):
+    yield from router.get_db(request, response)
+
+def get_write_db():
+    # Primary session for WebSocket routes, which have no request method to route on.
+    # Held for the whole connection, commits hand its connection back to the pool in between.
+    db = router.write_primary()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
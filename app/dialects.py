@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta, UTC
+import re
+
+from sqlalchemy import DateTime, Date, Float, String, cast, func, literal
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import TypeDecorator
+
+
+# Text format SQLite timestamps are generated in, sorts the same way as SQLAlchemy's stored format
+SQLITE_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%f"
+
+
+# Search tokens: runs of word characters, lowercased, the same on both dialects
+SEARCH_WORD = re.compile(r"\w+")
+
+
+def search_text(value: str | None) -> str | None:
+    # SQLite stand-in for the tsvector, registered as a SQL function on every SQLite
+    # connection. The words of value between spaces, so " word" only matches word starts.
+    if value is None:
+        return None
+    return f" {' '.join(SEARCH_WORD.findall(value.lower()))} "
+
+
+def dialect_name(bind) -> str:
+    # Accepts a Session, Engine or Connection
+    if isinstance(bind, Session):
+        bind = bind.get_bind()
+    return bind.dialect.name
+
+
+def upsert_insert(bind, table):
+    # INSERT with on_conflict_do_update(), both dialects spell the upsert the same way
+    if dialect_name(bind) == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+class UTCDateTime(TypeDecorator):
+    # timestamptz on Postgres. SQLite has no timezone support, so values are stored as
+    # naive UTC and come back as aware UTC datetimes, the same as on Postgres.
+    impl = DateTime
+    cache_ok = True
+
+    def __init__(self):
+        super().__init__(timezone=True)
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and dialect.name == "sqlite" and value.tzinfo is not None:
+            value = value.astimezone(UTC).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=UTC)
+        return value
+
+    def coerce_compared_value(self, op, value):
+        # Intervals added to a timestamp keep their own type
+        if isinstance(value, datetime):
+            return self
+        return self.impl.coerce_compared_value(op, value)
+
+
+class utcnow(FunctionElement):
+    # Database time, optionally shifted: utcnow(timedelta(seconds=60)). Postgres uses now(),
+    # which is fixed for the whole transaction.
+    type = UTCDateTime()
+    inherit_cache = True
+
+    def __init__(self, offset: timedelta | None = None):
+        if offset is None:
+            super().__init__()
+        else:
+            super().__init__(literal(offset.total_seconds(), Float))
+
+
+@compiles(utcnow)
+def _utcnow_postgresql(element, compiler, **kw):
+    if not element.clauses.clauses:
+        return "now()"
+    return f"(now() + make_interval(secs => {compiler.process(element.clauses, **kw)}))"
+
+
+@compiles(utcnow, "sqlite")
+def _utcnow_sqlite(element, compiler, **kw):
+    args = [literal(SQLITE_TIMESTAMP_FORMAT), literal("now")]
+    if element.clauses.clauses:
+        args.append(cast(element.clauses.clauses[0], String).concat(" seconds"))
+    return compiler.process(func.strftime(*args), **kw)
+
+
+class utc_date(FunctionElement):
+    # Calendar day of a timestamp in UTC
+    type = Date()
+    inherit_cache = True
+
+
+@compiles(utc_date)
+def _utc_date_postgresql(element, compiler, **kw):
+    return compiler.process(cast(func.timezone("UTC", *element.clauses), Date), **kw)
+
+
+@compiles(utc_date, "sqlite")
+def _utc_date_sqlite(element, compiler, **kw):
+    # Stored timestamps are already UTC
+    return compiler.process(func.date(*element.clauses), **kw)
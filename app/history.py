@@ -0,0 +1,103 @@
+from sqlalchemy import and_, func, select, true, tuple_
+from sqlalchemy.orm import Session, aliased
+
+from .dialects import dialect_name
+from .models import Card, Deck, ReviewHistory
+
+
+# Columns returned per review, card_id comes from the owned card side of the join
+HISTORY_COLUMNS = [
+    "id", "reviewed_at", "quality",
+    "repetition_before", "interval_before", "ease_before",
+    "repetition_after", "interval_after", "ease_after", "next_review_at_after",
+]
+
+
+def _owned_cards(user_id: int, card_ids: list[int]):
+    return (
+        select(Card.id.label("card_id"))
+        .join(Deck, Deck.id == Card.deck_id)
+        .where(Card.id.in_(card_ids), Deck.user_id == user_id, Deck.deleted_at.is_(None))
+        .subquery("owned")
+    )
+
+
+def _before(card_id: int, before_id: int):
+    # Keyset on (reviewed_at, id) desc, starting after the review the client saw last.
+    # The plain reviewed_at bound lets the (card_id, reviewed_at desc) index seek to the page.
+    seen = aliased(ReviewHistory)
+    cursor = select(seen.reviewed_at).where(seen.id == before_id, seen.card_id == card_id).scalar_subquery()
+    return and_(
+        ReviewHistory.reviewed_at <= cursor,
+        tuple_(ReviewHistory.reviewed_at, ReviewHistory.id) < tuple_(cursor, before_id),
+    )
+
+
+def _recent_reviews(db: Session, user_id: int, card_ids: list[int], per_card: int, before_id: int | None = None) -> dict[int, list[dict]]:
+    # One query: ownership filter on the outer side, the newest reviews of each owned card joined to it.
+    # Cards that aren't owned are missing from the result, owned cards without reviews map to [].
+    # Paging with before_id is for a single card
+    owned = _owned_cards(user_id, card_ids)
+    newest_first = (ReviewHistory.reviewed_at.desc(), ReviewHistory.id.desc())
+
+    if dialect_name(db) == "postgresql":
+        # LATERAL: an index scan per card that stops after per_card rows
+        recent = (
+            select(*(getattr(ReviewHistory, c) for c in HISTORY_COLUMNS))
+            .where(ReviewHistory.card_id == owned.c.card_id)
+            .order_by(*newest_first)
+            .limit(per_card)
+        )
+        if before_id is not None:
+            recent = recent.where(_before(card_ids[0], before_id))
+        recent = recent.lateral("recent")
+        on_clause = true()
+    else:
+        # SQLite has no LATERAL, number each card's reviews and keep the first per_card
+        recent = (
+            select(
+                ReviewHistory.card_id,
+                *(getattr(ReviewHistory, c) for c in HISTORY_COLUMNS),
+                func.row_number().over(partition_by=ReviewHistory.card_id, order_by=newest_first).label("position"),
+            )
+            .where(ReviewHistory.card_id.in_(select(owned.c.card_id)))
+        )
+        if before_id is not None:
+            recent = recent.where(_before(card_ids[0], before_id))
+        recent = recent.subquery("recent")
+        on_clause = and_(recent.c.card_id == owned.c.card_id, recent.c.position <= per_card)
+
+    rows = db.execute(
+        select(owned.c.card_id, *(recent.c[c] for c in HISTORY_COLUMNS))
+        .select_from(owned.outerjoin(recent, on_clause))
+        .order_by(owned.c.card_id, recent.c.reviewed_at.desc(), recent.c.id.desc())
+    ).all()
+
+    reviews: dict[int, list[dict]] = {}
+    for row in rows:
+        entries = reviews.setdefault(row.card_id, [])
+        if row.id is not None:
+            entries.append({c: getattr(row, c) for c in HISTORY_COLUMNS})
+    return reviews
+
+
+def card_history_page(db: Session, user_id: int, card_id: int, limit: int, before_id: int | None) -> dict | None:
+    # None when the card doesn't exist or isn't the user's
+    reviews = _recent_reviews(db, user_id, [card_id], limit + 1, before_id)
+    if card_id not in reviews:
+        return None
+
+    page = reviews[card_id]
+    has_more = len(page) > limit
+    page = page[:limit]
+    return {
+        "card_id": card_id,
+        "reviews": page,
+        "cursor": page[-1]["id"] if page else before_id,
+        "has_more": has_more,
+    }
+
+
+def recent_history(db: Session, user_id: int, card_ids: list[int], per_card: int) -> list[dict]:
+    reviews = _recent_reviews(db, user_id, card_ids, per_card)
+    return [{"card_id": card_id, "reviews": entries} for card_id, entries in reviews.items()]
@@ -0,0 +1,168 @@
+from .config import REVIEW_HISTORY_DURABILITY, HISTORY_FLUSH_MAX_ROWS, HISTORY_FLUSH_INTERVAL_SECONDS
+
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from sqlalchemy import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from .models import ReviewHistory
+
+
+DURABILITY_MODES = ("sync", "group", "async")
+
+# In async mode, reviews wait for a flush once this many rows are pending, so a stalled
+# database applies backpressure instead of growing the buffer without bound
+MAX_PENDING_ROWS = 10_000
+
+# Longest a review waits for its batch. Flushes take milliseconds, this only fires when
+# the flusher thread is stuck or gone.
+FLUSH_WAIT_TIMEOUT_SECONDS = 10.0
+
+
+class HistoryWriteError(RuntimeError):
+    # The review's history row was not confirmed written
+    pass
+
+
+class HistoryBuffer:
+    # Review history rows written behind the schedule update, in multi-row batches.
+    # "group": the request returns once the batch holding its row is committed, so
+    # concurrent reviews share one commit. "async": it returns right away, rows still
+    # in the buffer are lost if the process dies before the next flush.
+    def __init__(self, bind: Engine, mode: str, max_rows: int = HISTORY_FLUSH_MAX_ROWS, interval: float = HISTORY_FLUSH_INTERVAL_SECONDS):
+        if mode not in ("group", "async"):
+            raise ValueError(f"HistoryBuffer mode must be group or async, not {mode}")
+        self.bind = bind
+        self.mode = mode
+        self.max_rows = max_rows
+        self.interval = interval
+
+        self._rows: list[dict] = []
+        self._waiters: list[Future] = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._closed = False
+
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.rows_dropped = 0
+        self.last_batch_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def add(self, row: dict):
+        # Raises HistoryWriteError in group mode when the row failed, or in either
+        # mode when a flush it has to wait for doesn't finish in time
+        done = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("History buffer is closed")
+            # Started on first use, after the serve CLI has forked its workers,
+            # and again should it have died
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="history-flush", daemon=True)
+                self._thread.start()
+
+            self._rows.append(row)
+            self._waiters.append(done)
+            if len(self._rows) >= self.max_rows:
+                self._cond.notify()
+            wait = self.mode == "group" or len(self._rows) >= MAX_PENDING_ROWS
+        if not wait:
+            return
+        try:
+            written = done.result(timeout=FLUSH_WAIT_TIMEOUT_SECONDS)
+        except FutureTimeout:
+            raise HistoryWriteError(f"History flush did not finish within {FLUSH_WAIT_TIMEOUT_SECONDS}s")
+        # Async rows are allowed to be lost, the wait was only backpressure
+        if not written and self.mode == "group":
+            raise HistoryWriteError("History row could not be written")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or len(self._rows) >= self.max_rows, timeout=self.interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                rows, waiters = self._rows, self._waiters
+                self._rows, self._waiters = [], []
+            if not rows:
+                return
+
+            started = time.perf_counter()
+            try:
+                with self.bind.begin() as conn:
+                    conn.execute(insert(ReviewHistory), rows)
+                written = [True] * len(rows)
+            except SQLAlchemyError:
+                # One bad row (its card deleted meanwhile) must not cost the rest of the batch
+                written = self._insert_each(rows)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            dropped = written.count(False)
+
+            self.flushes += 1
+            self.rows_flushed += len(rows) - dropped
+            self.rows_dropped += dropped
+            self.last_batch_rows = len(rows)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+
+            for done, row_written in zip(waiters, written):
+                done.set_result(row_written)
+
+    def _insert_each(self, rows: list[dict]) -> list[bool]:
+        written = []
+        for row in rows:
+            try:
+                with self.bind.begin() as conn:
+                    conn.execute(insert(ReviewHistory), row)
+                written.append(True)
+            except SQLAlchemyError:
+                written.append(False)
+        return written
+
+    def close(self):
+        # Graceful shutdown: stop the flusher and write whatever is still buffered
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def metrics(self) -> dict:
+        with self._cond:
+            depth = len(self._rows)
+        return {
+            "mode": self.mode,
+            "depth": depth,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "rows_dropped": self.rows_dropped,
+            "last_batch_rows": self.last_batch_rows,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "mean_flush_ms": round(self._total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+
+def create_history_buffer(bind: Engine) -> HistoryBuffer | None:
+    # None in sync mode: history is inserted in the review's own transaction
+    if REVIEW_HISTORY_DURABILITY not in DURABILITY_MODES:
+        raise ValueError(f"Unknown REVIEW_HISTORY_DURABILITY: {REVIEW_HISTORY_DURABILITY}")
+    if REVIEW_HISTORY_DURABILITY == "sync":
+        return None
+    return HistoryBuffer(bind, REVIEW_HISTORY_DURABILITY)
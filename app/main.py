@@ -1,18 +1,40 @@
 from .config import ENV
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, Query, Header, Response, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import select, update, insert, literal, or_, text, func
+from sqlalchemy.exc import SQLAlchemyError
 
-from .database import engine, get_db
-from .models import Base, User, Deck, Card, CardSchedule, ReviewHistory
-from .schemas import SignupIn, LoginIn, DeleteAccountIn, DeckCreate, DeckOut, CardCreate, CardOut, CardUpdate, ReviewIn
+from datetime import timedelta, datetime, date, UTC
+import math
+
+from pydantic import ValidationError
+
+from .database import engine, router, get_db, get_write_db, pool_status
+from .dialects import dialect_name, utcnow
+from .models import Base, User, Deck, Card, CardSchedule, ChangeLog
+from .schemas import SignupIn, LoginIn, DeleteAccountIn, DeckCreate, DeckOut, CardCreate, CardOut, CardSearchOut, CardUpdate, ReviewIn, SyncOut, DailyStatsOut, CardHistoryPageOut, CardRecentHistoryOut, DeckCloneIn, DeckCloneOut, TemplateOut, StudyReviewIn
 from .security import hash_password, verify_password, create_access_token, decode_access_token
-from .sm2 import sm2_update
+from .review import apply_review
+from .history_buffer import HistoryWriteError, create_history_buffer
+from .search import search_cards
+from .history import card_history_page, recent_history
+from .clone import clone_deck
+from .study import StudySession, claim_due, learn, lease_available
+from .stats import bump_daily_stats, daily_stats, utc_day
+from .ratelimit import RateLimitMiddleware, create_limiter
+from .profiling import ProfilingMiddleware, profiling_enabled
+from .purge import exceeds_soft_delete_threshold, purge_deck, purge_user
+from .changelog import (
+    record_change, record_changes,
+    ENTITY_DECK, ENTITY_CARD, ENTITY_SCHEDULE, OP_UPSERT, OP_DELETE,
+)
 
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
+from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
 
 
 # --- Startup ---
@@ -22,8 +44,33 @@ if ENV == "dev":
     Base.metadata.drop_all(bind=engine)
 
 Base.metadata.create_all(bind=engine)
+
+# Write-behind review history, None unless REVIEW_HISTORY_DURABILITY is group or async
+history_buffer = create_history_buffer(engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Runs after in-flight requests have drained, nothing is added to the buffer anymore
+    if history_buffer is not None:
+        await run_in_threadpool(history_buffer.close)
     
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# Set by the serve CLI once shutdown starts, readiness fails while in-flight requests drain
+app.state.draining = False
+
+# Sampling profiler for selected requests, inside rate limiting so rejected requests are never profiled
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+
+# Per-client token buckets and global load shedding, outermost so rejected requests stay cheap
+limiter = create_limiter(engine)
+app.add_middleware(RateLimitMiddleware, limiter=limiter)
+
+# Replica stickiness keeps each client's last write in the limiter's backend, shared by
+# workers when that is the database
+router.marks = limiter.backend
 app.mount("/ui", StaticFiles(directory=str(Path(__file__).resolve().parent / "static"), html=True), name="ui")
 
 
@@ -42,6 +89,47 @@ def get_current_user_id(creds: HTTPAuthorizationCredentials = Depends(bearer_sch
         )
 
 
+# --- Review helpers ---
+
+def submit_review(db: Session, user_id: int, card_id: int, quality: int) -> dict:
+    # Shared by the review route and study sockets
+
+    # Lock, due check, SM-2 update and history insert (or its row, for the write-behind buffer)
+    result = apply_review(db, user_id, card_id, quality, defer_history=history_buffer is not None)
+
+    bump_daily_stats(db, user_id, result["deck_id"], utc_day(utcnow()), reviews=1, failures=int(quality < 3))
+    record_change(db, user_id, ENTITY_SCHEDULE, card_id, OP_UPSERT, result["deck_id"])
+    db.commit()
+
+    # Only after the commit, a rolled back review must not leave history behind
+    if history_buffer is not None:
+        try:
+            history_buffer.add(result["history"])
+        except HistoryWriteError:
+            # The schedule is saved, but group mode promised the history too
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Review saved but its history could not be written",
+            )
+    return result
+
+
+# --- Stats helpers ---
+
+STATS_DEFAULT_DAYS = 365
+
+def stats_range(start: date | None, end: date | None) -> tuple[date, date]:
+    # Default to the year ending today (UTC)
+    end = end or datetime.now(UTC).date()
+    start = start or end - timedelta(days=STATS_DEFAULT_DAYS - 1)
+    if start > end:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="start must be on or before end",
+        )
+    return start, end
+
+
 # --- Routes ---
 
 @app.get("/")
@@ -52,12 +140,35 @@ def root():
 def health():
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready(response: Response):
+    pool = pool_status(engine)
+    database = "ok"
+
+    # An exhausted pool would block the probe, report it instead of waiting for a connection
+    if "checked_out" in pool and pool["checked_out"] >= pool["size"] + pool["max_overflow"]:
+        database = "pool exhausted"
+    else:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except SQLAlchemyError:
+            database = "unreachable"
+
+    is_ready = database == "ok" and not app.state.draining
+    if not is_ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    body = {"status": "ready" if is_ready else "not ready", "draining": app.state.draining, "database": database, "pool": pool}
+    if history_buffer is not None:
+        body["history_buffer"] = history_buffer.metrics()
+    return body
+
 
 # --- User routes ---
 
 @app.post("/signup", status_code=status.HTTP_201_CREATED)
 def signup(payload: SignupIn, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.email == payload.email).first()
+    existing = db.query(User).filter(User.email == payload.email, User.deleted_at.is_(None)).first()
     if existing:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
@@ -73,7 +184,7 @@ def signup(payload: SignupIn, db: Session = Depends(get_db)):
 
 @app.post("/login")
 def login(payload: LoginIn, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == payload.email).first()
+    user = db.query(User).filter(User.email == payload.email, User.deleted_at.is_(None)).first()
     if not user or not verify_password(payload.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -87,13 +198,24 @@ def login(payload: LoginIn, db: Session = Depends(get_db)):
 def me(user_id: int = Depends(get_current_user_id)):
     return {"user_id": user_id}
 
+@app.get("/me/stats", response_model=list[DailyStatsOut])
+def my_stats(
+    start: date | None = None,
+    end: date | None = None,
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    start, end = stats_range(start, end)
+    return daily_stats(db, user_id, start, end)
+
 @app.delete("/users/me", status_code=status.HTTP_204_NO_CONTENT)
 def delete_me(
     payload: DeleteAccountIn,
+    background_tasks: BackgroundTasks,
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
-    user = db.query(User).filter(User.id == user_id).first()
+    user = db.query(User).filter(User.id == user_id, User.deleted_at.is_(None)).first()
 
     if not user:
         raise HTTPException(
@@ -108,6 +230,15 @@ def delete_me(
             detail="Incorrect password",
         )
 
+    # Large accounts are soft-deleted now and purged in chunks after the response
+    if exceeds_soft_delete_threshold(db, Deck.user_id == user_id):
+        user.deleted_at = utcnow()
+        db.query(Deck).filter(Deck.user_id == user_id, Deck.deleted_at.is_(None)).update({Deck.deleted_at: utcnow()}, synchronize_session=False)
+        db.commit()
+        background_tasks.add_task(purge_user, db.get_bind(), user_id)
+        return
+
+    # Passive delete, the database cascades to decks, cards, schedules and history
     db.delete(user)
     db.commit()
     return
@@ -123,6 +254,9 @@ def create_deck(
 ):
     deck = Deck(name=payload.name, user_id=user_id)
     db.add(deck)
+    db.flush()
+
+    record_change(db, user_id, ENTITY_DECK, deck.id, OP_UPSERT)
     db.commit()
     db.refresh(deck)
     return deck
@@ -134,7 +268,7 @@ def list_decks(
 ):
     decks = (
         db.query(Deck)
-        .filter(Deck.user_id == user_id)
+        .filter(Deck.user_id == user_id, Deck.deleted_at.is_(None))
         .order_by(Deck.id.asc())
         .all()
     )
@@ -148,7 +282,7 @@ def get_deck(
 ):
     deck = (
         db.query(Deck)
-        .filter(Deck.id == deck_id, Deck.user_id == user_id)
+        .filter(Deck.id == deck_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
         .first()
     )
 
@@ -163,12 +297,13 @@ def get_deck(
 @app.delete("/decks/{deck_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_deck(
     deck_id: int,
+    background_tasks: BackgroundTasks,
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
     deck = (
         db.query(Deck)
-        .filter(Deck.id == deck_id, Deck.user_id == user_id)
+        .filter(Deck.id == deck_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
         .first()
     )
 
@@ -178,11 +313,162 @@ def delete_deck(
             detail="Deck not found",
         )
 
+    # Large decks are soft-deleted now and purged in chunks after the response
+    if exceeds_soft_delete_threshold(db, Card.deck_id == deck_id):
+        deck.deleted_at = utcnow()
+        db.flush()
+        record_change(db, user_id, ENTITY_DECK, deck_id, OP_DELETE)
+        db.commit()
+        background_tasks.add_task(purge_deck, db.get_bind(), deck_id)
+        return
+
+    # Passive delete, the database cascades to cards, schedules and history.
+    # Recorded after the delete: entity rows are locked before the users row, as in reviews.
     db.delete(deck)
+    db.flush()
+    record_change(db, user_id, ENTITY_DECK, deck_id, OP_DELETE)
     db.commit()
     return
 
 
+@app.get("/decks/{deck_id}/stats", response_model=list[DailyStatsOut])
+def deck_stats(
+    deck_id: int,
+    start: date | None = None,
+    end: date | None = None,
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    # Confirm deck exists and belongs to user
+    deck_exists = (
+        db.query(Deck.id)
+        .filter(Deck.id == deck_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
+        .first()
+    )
+    if not deck_exists:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deck not found",
+        )
+
+    start, end = stats_range(start, end)
+    return daily_stats(db, user_id, start, end, deck_id)
+
+def set_template(db: Session, user_id: int, deck_id: int, is_template: bool) -> Deck:
+    deck = (
+        db.query(Deck)
+        .filter(Deck.id == deck_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
+        .first()
+    )
+    if not deck:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deck not found",
+        )
+
+    deck.is_template = is_template
+    db.flush()
+    record_change(db, user_id, ENTITY_DECK, deck.id, OP_UPSERT)
+    db.commit()
+    db.refresh(deck)
+    return deck
+
+@app.post("/decks/{deck_id}/publish", response_model=DeckOut)
+def publish_deck(
+    deck_id: int,
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    return set_template(db, user_id, deck_id, True)
+
+@app.delete("/decks/{deck_id}/publish", response_model=DeckOut)
+def unpublish_deck(
+    deck_id: int,
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    return set_template(db, user_id, deck_id, False)
+
+@app.post("/decks/{deck_id}/clone", response_model=DeckCloneOut, status_code=status.HTTP_201_CREATED)
+def clone(
+    deck_id: int,
+    payload: DeckCloneIn | None = None,
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    payload = payload or DeckCloneIn()
+
+    # Own decks and published templates can be cloned
+    source = (
+        db.query(Deck)
+        .filter(Deck.id == deck_id, or_(Deck.user_id == user_id, Deck.is_template), Deck.deleted_at.is_(None))
+        .first()
+    )
+    if not source:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deck not found",
+        )
+
+    # Another user's schedules are their study progress, not part of the template
+    if payload.schedule == "carry" and source.user_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Schedules can only be carried over from your own decks",
+        )
+
+    deck, copied = clone_deck(db, user_id, source, payload.name or source.name, carry=payload.schedule == "carry")
+    record_change(db, user_id, ENTITY_DECK, deck.id, OP_UPSERT)
+    db.commit()
+    db.refresh(deck)
+    return {"deck": deck, "cards_copied": copied}
+
+
+# --- Template routes ---
+
+@app.get("/templates", response_model=list[TemplateOut])
+def list_templates(
+    limit: int = Query(default=50, ge=1, le=200),
+    offset: int = Query(default=0, ge=0),
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    card_count = select(func.count()).where(Card.deck_id == Deck.id).correlate(Deck).scalar_subquery()
+    templates = db.execute(
+        select(Deck.id, Deck.name, card_count.label("card_count"))
+        .where(Deck.is_template, Deck.deleted_at.is_(None))
+        .order_by(Deck.id.asc())
+        .limit(limit)
+        .offset(offset)
+    ).all()
+    return templates
+
+@app.get("/templates/{deck_id}/cards", response_model=list[CardOut])
+def list_template_cards(
+    deck_id: int,
+    after: int | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    # Read-only view for any user, paged by card id since templates can be large
+    template = (
+        db.query(Deck.id)
+        .filter(Deck.id == deck_id, Deck.is_template, Deck.deleted_at.is_(None))
+        .first()
+    )
+    if not template:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Template not found",
+        )
+
+    cards = db.query(Card).filter(Card.deck_id == deck_id)
+    if after is not None:
+        cards = cards.filter(Card.id > after)
+    return cards.order_by(Card.id.asc()).limit(limit).all()
+
+
 # --- Card routes ---
 
 @app.post("/decks/{deck_id}/cards", response_model=CardOut, status_code=status.HTTP_201_CREATED)
@@ -195,7 +481,7 @@ def create_card(
     # Confirm deck exists AND belongs to user
     _deck = (
         db.query(Deck)
-        .filter(Deck.id == deck_id, Deck.user_id == user_id)
+        .filter(Deck.id == deck_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
         .first()
     )
     if not _deck:
@@ -207,6 +493,9 @@ def create_card(
     # Create the card linked to that deck
     card = Card(front=payload.front, back=payload.back, deck_id=deck_id)
     db.add(card)
+    db.flush()
+
+    record_change(db, user_id, ENTITY_CARD, card.id, OP_UPSERT, deck_id)
     db.commit()
     db.refresh(card)
     return card
@@ -220,7 +509,7 @@ def list_cards(
     # Confirm deck exists AND belongs to user
     _deck = (
         db.query(Deck)
-        .filter(Deck.id == deck_id, Deck.user_id == user_id)
+        .filter(Deck.id == deck_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
         .first()
     )
     if not _deck:
@@ -238,6 +527,18 @@ def list_cards(
 
     return cards
 
+@app.get("/cards/search", response_model=list[CardSearchOut])
+def search(
+    q: str = Query(min_length=1, max_length=200),
+    deck_id: int | None = None,
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0),
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    # Ranked, paginated and ownership-filtered in a single query
+    return search_cards(db, user_id, q, deck_id, limit, offset)
+
 @app.get("/decks/{deck_id}/cards/new", response_model=CardOut)
 def get_new_card(
     deck_id: int,
@@ -246,7 +547,7 @@ def get_new_card(
 ):
     deck_exists = (
         db.query(Deck.id)
-        .filter(Deck.id == deck_id, Deck.user_id == user_id)
+        .filter(Deck.id == deck_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
         .first()
     )
     if not deck_exists:
@@ -274,13 +575,14 @@ def get_new_card(
 @app.get("/decks/{deck_id}/cards/due", response_model=CardOut)
 def get_due_card(
     deck_id: int,
+    device_id: str | None = Header(default=None, alias="X-Device-Id", max_length=64),
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
     # Confirm deck exists and belongs to user
     deck_exists = (
         db.query(Deck.id)
-        .filter(Deck.id == deck_id, Deck.user_id == user_id)
+        .filter(Deck.id == deck_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
         .first()
     )
     if not deck_exists:
@@ -289,12 +591,13 @@ def get_due_card(
             detail="Deck not found",
         )
 
-    # Fetch first due card for this deck (index-driven)
+    # Fetch first due card for this deck (index-driven), skipping cards leased to other devices
     card = (
         db.query(Card)
         .join(CardSchedule, CardSchedule.card_id == Card.id)
         .filter(CardSchedule.deck_id == deck_id)
-        .filter(CardSchedule.next_review_at <= func.now())
+        .filter(CardSchedule.next_review_at <= utcnow())
+        .filter(lease_available(device_id))
         .order_by(CardSchedule.next_review_at.asc())
         .first()
     )
@@ -307,50 +610,103 @@ def get_due_card(
 
     return card
 
+@app.post("/decks/{deck_id}/cards/due/claim", response_model=list[CardOut])
+def claim_due_cards(
+    deck_id: int,
+    count: int = Query(default=10, ge=1, le=100),
+    lease_seconds: int = Query(default=60, ge=5, le=600),
+    device_id: str = Header(alias="X-Device-Id", min_length=1, max_length=64),
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    return claim_due(db, user_id, deck_id, count, lease_seconds, device_id)
+
 @app.post("/cards/{card_id}/learn", status_code=status.HTTP_201_CREATED)
 def learn_card(
     card_id: int,
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
-    # Fetch card + enforce ownership via deck. Lock card to prevent race
-    # condition where two requests may pass the is_learned check, and both
-    # try to create the schedule.
-    card = (
-        db.query(Card)
-        .join(Deck, Card.deck_id == Deck.id)
-        .filter(Card.id == card_id, Deck.user_id == user_id)
-        .with_for_update()
+    learn(db, user_id, card_id)
+    return
+
+@app.post("/decks/{deck_id}/cards/learn", response_model=list[CardOut], status_code=status.HTTP_201_CREATED)
+def learn_cards(
+    deck_id: int,
+    count: int = Query(default=20, ge=1, le=100),
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    # Confirm deck exists and belongs to user
+    deck_exists = (
+        db.query(Deck.id)
+        .filter(Deck.id == deck_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
         .first()
     )
-    if not card:
+    if not deck_exists:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Card not found",
+            detail="Deck not found",
         )
 
-    # Reject if already learned
-    if card.is_learned:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="Card is already learned",
+    # Next N unlearned cards (index-driven)
+    picked = (
+        select(Card.id)
+        .where(Card.deck_id == deck_id, Card.is_learned == False)
+        .order_by(Card.id.asc())
+        .limit(count)
+    )
+    schedule_columns = ["card_id", "deck_id", "repetition_count", "interval_days", "ease_factor", "next_review_at"]
+
+    if dialect_name(db) == "sqlite":
+        # No DML in CTEs on SQLite. The request already holds the write lock, so
+        # pick, flip and schedule as separate statements.
+        card_ids = db.execute(picked).scalars().all()
+        db.execute(update(Card).where(Card.id.in_(card_ids)).values(is_learned=True))
+        db.execute(
+            insert(CardSchedule).from_select(
+                schedule_columns,
+                select(Card.id, Card.deck_id, literal(0), literal(0), literal(2.5), utcnow()).where(Card.id.in_(card_ids)),
+            )
+        )
+        cards = db.execute(select(Card.id, Card.front, Card.back).where(Card.id.in_(card_ids)).order_by(Card.id.asc())).all()
+    else:
+        # SKIP LOCKED lets a concurrent device take the following cards instead of
+        # blocking on, and double-learning, these
+        picked = picked.with_for_update(skip_locked=True).cte("picked")
+
+        # Flip the learned flag on exactly the locked rows
+        flipped = (
+            update(Card)
+            .where(Card.id == picked.c.id)
+            .values(is_learned=True)
+            .returning(Card.id, Card.front, Card.back, Card.deck_id)
+            .cte("flipped")
         )
 
-    # Create initial schedule (due immediately)
-    schedule = CardSchedule(
-        card_id=card.id,
-        deck_id=card.deck_id,
-        repetition_count=0,
-        interval_days=0,
-        ease_factor=2.5,
-        next_review_at=func.now(),
-        last_reviewed_at=None,
-    )
+        # Create initial schedules (due immediately) for the flipped cards
+        scheduled = (
+            insert(CardSchedule)
+            .from_select(
+                schedule_columns,
+                select(flipped.c.id, flipped.c.deck_id, literal(0), literal(0), literal(2.5), utcnow()),
+            )
+            .cte("scheduled")
+        )
 
-    card.is_learned = True
-    db.add(schedule)
+        cards = db.execute(
+            select(flipped.c.id, flipped.c.front, flipped.c.back)
+            .add_cte(scheduled)
+            .order_by(flipped.c.id.asc())
+        ).all()
+
+    card_ids = [card.id for card in cards]
+    if card_ids:
+        bump_daily_stats(db, user_id, deck_id, utc_day(utcnow()), new_cards=len(card_ids))
+    record_changes(db, user_id, ENTITY_CARD, card_ids, OP_UPSERT, deck_id)
+    record_changes(db, user_id, ENTITY_SCHEDULE, card_ids, OP_UPSERT, deck_id)
     db.commit()
-    return
+    return cards
 
 @app.post("/cards/{card_id}/review")
 def review_card(
@@ -359,77 +715,36 @@ def review_card(
     user_id: int = Depends(get_current_user_id),
     db: Session = Depends(get_db),
 ):
-    # Fetch card schedule + enforce ownership via deck. Lock schedule to ensure
-    # one review will always map to one history being created (race condition)
-    result = (
-        db.query(CardSchedule, func.now())
-        .join(Card, CardSchedule.card_id == Card.id)
-        .join(Deck, Card.deck_id == Deck.id)
-        .filter(Card.id == card_id, Deck.user_id == user_id)
-        .with_for_update(of=CardSchedule)
-        .first()
-        )
-    if not result:
-        # We don't know if the card ID is wrong OR if the card is just not learned yet
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Card not found or not learned."
-        )
+    submit_review(db, user_id, card_id, payload.quality)
+    return
 
-    # Unpack the tuple: (CardSchedule object, datetime object)
-    schedule, db_now = result
-    
-    # If a previous request just completed and the schedule is now unlocked, 
-    # another race condition is possible where the schedule could accidentally get 
-    # updated (reviewed) twice. Ensure the card is actually still due. 
-    if schedule.next_review_at > db_now:
+@app.get("/cards/history", response_model=list[CardRecentHistoryOut])
+def cards_recent_history(
+    card_ids: list[int] = Query(min_length=1, max_length=100),
+    per_card: int = Query(default=5, ge=1, le=50),
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    # Last reviews of several cards in one query, for prefetching a study session.
+    # Cards the user doesn't own are left out.
+    return recent_history(db, user_id, card_ids, per_card)
+
+@app.get("/cards/{card_id}/history", response_model=CardHistoryPageOut)
+def card_history(
+    card_id: int,
+    before: int | None = None,
+    limit: int = Query(default=20, ge=1, le=100),
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    # Newest first, ownership checked in the same query
+    page = card_history_page(db, user_id, card_id, limit, before)
+    if page is None:
         raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="Card was already reviewed and is no longer due."
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Card not found",
         )
-    
-    # Get current schedule values
-    repetition_before = schedule.repetition_count
-    interval_before = schedule.interval_days
-    ease_before = schedule.ease_factor
-    timestamp = db_now
-
-    # Unpack payload
-    quality = payload.quality
-    
-    # Get new values from sm-2 algo
-    updated_vals = sm2_update(
-        repetition_before,
-        interval_before,
-        ease_before,
-        quality,
-        timestamp,
-    )
-
-    # Update to new card schedule values
-    schedule.repetition_count = updated_vals["repetition_count"]
-    schedule.interval_days = updated_vals["interval_days"]
-    schedule.ease_factor = updated_vals["ease_factor"]
-    schedule.next_review_at = updated_vals["next_review_at"]
-    schedule.last_reviewed_at = timestamp
-
-    # Create history for the review
-    history = ReviewHistory(
-        card_id=card_id,
-        reviewed_at=timestamp,
-        quality=quality,
-        repetition_before=repetition_before,
-        interval_before=interval_before,
-        ease_before=ease_before,
-        repetition_after=schedule.repetition_count,
-        interval_after=schedule.interval_days,
-        ease_after=schedule.ease_factor,
-        next_review_at_after=schedule.next_review_at,
-    )
-    
-    db.add(history)
-    db.commit()
-    return
+    return page
 
 @app.patch("/cards/{card_id}", response_model=CardOut)
 def update_card(
@@ -450,7 +765,7 @@ def update_card(
     card = (
         db.query(Card)
         .join(Deck, Card.deck_id == Deck.id)
-        .filter(Card.id == card_id, Deck.user_id == user_id)
+        .filter(Card.id == card_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
         .first()
     )
 
@@ -466,6 +781,9 @@ def update_card(
     if payload.back is not None:
         card.back = payload.back
 
+    # Card row before the users row, the order learn and review lock in
+    db.flush()
+    record_change(db, user_id, ENTITY_CARD, card.id, OP_UPSERT, card.deck_id)
     db.commit()
     db.refresh(card)
     return card
@@ -479,7 +797,7 @@ def delete_card(
     card = (
         db.query(Card)
         .join(Deck, Card.deck_id == Deck.id)
-        .filter(Card.id == card_id, Deck.user_id == user_id)
+        .filter(Card.id == card_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
         .first()
     )
 
@@ -489,6 +807,158 @@ def delete_card(
             detail="Card not found",
         )
 
+    # Recorded after the delete: the cascade locks the schedule before the users row, as in reviews
+    card_id, deck_id = card.id, card.deck_id
     db.delete(card)
+    db.flush()
+    record_change(db, user_id, ENTITY_CARD, card_id, OP_DELETE, deck_id)
     db.commit()
-    return
\ No newline at end of file
+    return
+
+
+# --- Sync routes ---
+
+@app.get("/sync", response_model=SyncOut)
+def sync(
+    since: int = Query(default=0, ge=0),
+    limit: int = Query(default=500, ge=1, le=5000),
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+):
+    floor = db.query(User.sync_floor_seq).filter(User.id == user_id).scalar()
+    if floor is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+
+    # Tombstones after this cursor were compacted away, a delta would miss deletes.
+    # A full sync from 0 has no local state to delete, so it is always allowed.
+    if 0 < since < floor:
+        return SyncOut(cursor=0, has_more=False, reset=True, decks=[], cards=[], schedules=[], deleted_decks=[], deleted_cards=[])
+
+    # One extra row tells us whether another page follows
+    entries = (
+        db.query(ChangeLog.seq, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+        .filter(ChangeLog.user_id == user_id, ChangeLog.seq > since)
+        .order_by(ChangeLog.seq.asc())
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    changed = {(entity, op): [] for entity in (ENTITY_DECK, ENTITY_CARD, ENTITY_SCHEDULE) for op in (OP_UPSERT, OP_DELETE)}
+    for entry in entries:
+        changed[(entry.entity, entry.op)].append(entry.entity_id)
+
+    # Current state for upserted entities, anything deleted since is simply absent
+    decks = []
+    if changed[(ENTITY_DECK, OP_UPSERT)]:
+        decks = (
+            db.query(Deck)
+            .filter(Deck.id.in_(changed[(ENTITY_DECK, OP_UPSERT)]), Deck.user_id == user_id, Deck.deleted_at.is_(None))
+            .order_by(Deck.id.asc())
+            .all()
+        )
+
+    cards = []
+    if changed[(ENTITY_CARD, OP_UPSERT)]:
+        cards = (
+            db.query(Card)
+            .join(Deck, Card.deck_id == Deck.id)
+            .filter(Card.id.in_(changed[(ENTITY_CARD, OP_UPSERT)]), Deck.user_id == user_id, Deck.deleted_at.is_(None))
+            .order_by(Card.id.asc())
+            .all()
+        )
+
+    schedules = []
+    if changed[(ENTITY_SCHEDULE, OP_UPSERT)]:
+        schedules = (
+            db.query(CardSchedule)
+            .join(Deck, CardSchedule.deck_id == Deck.id)
+            .filter(CardSchedule.card_id.in_(changed[(ENTITY_SCHEDULE, OP_UPSERT)]), Deck.user_id == user_id, Deck.deleted_at.is_(None))
+            .order_by(CardSchedule.card_id.asc())
+            .all()
+        )
+
+    return SyncOut(
+        cursor=entries[-1].seq if entries else since,
+        has_more=has_more,
+        reset=False,
+        decks=decks,
+        cards=cards,
+        schedules=schedules,
+        deleted_decks=changed[(ENTITY_DECK, OP_DELETE)],
+        deleted_cards=changed[(ENTITY_CARD, OP_DELETE)],
+    )
+
+
+# --- Study session routes ---
+
+def _error_message(exc: HTTPException) -> dict:
+    return {"type": "error", "status": exc.status_code, "detail": exc.detail}
+
+@app.websocket("/ws/study/{deck_id}")
+async def study_socket(
+    websocket: WebSocket,
+    deck_id: int,
+    token: str | None = None,
+    new_limit: int = Query(default=20, ge=0, le=200),
+    db: Session = Depends(get_write_db),
+):
+    # Authenticated once per session. Browsers can't set headers on a WebSocket,
+    # so the token may also come as ?token=
+    auth = websocket.headers.get("authorization", "")
+    if auth.lower().startswith("bearer "):
+        token = auth[7:]
+    try:
+        user_id = decode_access_token(token or "")
+    except ValueError:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid or expired token")
+        return
+
+    await websocket.accept()
+    session = StudySession(db, user_id, deck_id, new_limit, review=submit_review)
+    try:
+        # Also the ownership check, the claim rejects decks that aren't the user's
+        try:
+            await run_in_threadpool(session.refill)
+        except HTTPException as exc:
+            await websocket.send_json(_error_message(exc))
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+
+        await websocket.send_json(await run_in_threadpool(session.next_card))
+        while True:
+            # {"card_id": ..., "quality": 0-5} for the current card
+            try:
+                grade = StudyReviewIn.model_validate(await websocket.receive_json())
+            except (ValidationError, ValueError):
+                await websocket.send_json({"type": "error", "status": 422, "detail": "Expected {\"card_id\": int, \"quality\": 0-5}"})
+                continue
+
+            # Grades spend the same bucket as POST /cards/{card_id}/review. The middleware limits
+            # the handshake but never sees the messages on an open socket.
+            if limiter.enabled:
+                retry_after = await limiter.take("review", f"user:{user_id}")
+                if retry_after:
+                    await websocket.send_json({"type": "error", "status": 429, "detail": "Too many requests", "retry_after": math.ceil(retry_after)})
+                    continue
+
+            # No cookie reaches the client from here, mark the user so their reads stay on the primary
+            await run_in_threadpool(router.mark_write, f"user:{user_id}")
+            try:
+                await websocket.send_json(await run_in_threadpool(session.grade, grade.card_id, grade.quality))
+            except HTTPException as exc:
+                await websocket.send_json(_error_message(exc))
+                if session.current is not None:
+                    continue
+
+            # Answer with the next card straight from the buffer, then top it up while the user thinks
+            await websocket.send_json(await run_in_threadpool(session.next_card))
+            await run_in_threadpool(session.refill)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await run_in_threadpool(session.close)
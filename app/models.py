@@ -1,21 +1,35 @@
-from sqlalchemy import ForeignKey, Integer, String, DateTime, Float, Index, Boolean
+from sqlalchemy import ForeignKey, Integer, String, Date, Float, Index, Boolean, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy.sql import func
 
-from datetime import datetime
+from datetime import datetime, date
 
 from .database import Base
+from .dialects import UTCDateTime, utcnow
 
 
 class User(Base):
     __tablename__ = "users"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    email: Mapped[str] = mapped_column(String, unique=True, nullable=False)
+    email: Mapped[str] = mapped_column(String, nullable=False)
     password_hash: Mapped[str] = mapped_column(String, nullable=False)
 
-    # Relationships
-    decks: Mapped[list["Deck"]] = relationship(back_populates="user", cascade="all, delete-orphan")
+    # Set when a large account is soft-deleted and waiting for the purge job
+    deleted_at: Mapped[datetime | None] = mapped_column(UTCDateTime(), nullable=True)
+
+    # Last change log sequence handed out, and the oldest cursor that can still sync incrementally
+    change_seq: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    sync_floor_seq: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+
+    # Relationships. Passive deletes leave cascading to the ON DELETE CASCADE foreign keys
+    decks: Mapped[list["Deck"]] = relationship(back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+
+    # Emails only need to be unique among live accounts, so a soft-deleted account frees its email
+    __table_args__ = (
+        Index("uq_users_email_active", "email", unique=True, postgresql_where=text("deleted_at IS NULL"), sqlite_where=text("deleted_at IS NULL")),
+        # SQLite would otherwise reuse the ids of deleted rows, which sync clients may still hold
+        {"sqlite_autoincrement": True},
+    )
 
 
 class Deck(Base):
@@ -27,9 +41,21 @@ class Deck(Base):
     # Index based on user to quickly find all decks belonging to a user
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
 
+    # Set when a large deck is soft-deleted and waiting for the purge job
+    deleted_at: Mapped[datetime | None] = mapped_column(UTCDateTime(), nullable=True)
+
+    # Published template: every user can browse and clone it, only the owner can change it
+    is_template: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False, server_default="0")
+
     # Relationships
     user: Mapped["User"] = relationship(back_populates="decks")
-    cards: Mapped[list["Card"]] = relationship(back_populates="deck", cascade="all, delete-orphan")
+    cards: Mapped[list["Card"]] = relationship(back_populates="deck", cascade="all, delete-orphan", passive_deletes=True)
+
+    # Small partial index for the template listing
+    __table_args__ = (
+        Index("ix_decks_template_id", "id", postgresql_where=text("is_template"), sqlite_where=text("is_template")),
+        {"sqlite_autoincrement": True},
+    )
 
 
 class Card(Base):
@@ -47,11 +73,11 @@ class Card(Base):
 
     # Relationships
     deck: Mapped["Deck"] = relationship(back_populates="cards")
-    schedule: Mapped["CardSchedule | None"] = relationship(back_populates="card", uselist=False, cascade="all, delete-orphan", single_parent=True)
-    review_history: Mapped[list["ReviewHistory"]] = relationship(back_populates="card", cascade="all, delete-orphan")
+    schedule: Mapped["CardSchedule | None"] = relationship(back_populates="card", uselist=False, cascade="all, delete-orphan", single_parent=True, passive_deletes=True)
+    review_history: Mapped[list["ReviewHistory"]] = relationship(back_populates="card", cascade="all, delete-orphan", passive_deletes=True)
 
     # Composite index to efficiently query new cards by deck
-    __table_args__ = (Index("ix_cards_deck_id_is_learned_id", "deck_id", "is_learned", "id"),)
+    __table_args__ = (Index("ix_cards_deck_id_is_learned_id", "deck_id", "is_learned", "id"), {"sqlite_autoincrement": True})
 
 class CardSchedule(Base):
     __tablename__ = "card_schedules"
@@ -68,12 +94,20 @@ class CardSchedule(Base):
     ease_factor: Mapped[float] = mapped_column(Float, nullable=False, default=2.5)
 
     # Essential
-    next_review_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    next_review_at: Mapped[datetime] = mapped_column(UTCDateTime(), nullable=False)
 
     # Nice to haves
-    last_reviewed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
-    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    last_reviewed_at: Mapped[datetime | None] = mapped_column(UTCDateTime(), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(UTCDateTime(), nullable=False, server_default=utcnow())
+    updated_at: Mapped[datetime] = mapped_column(UTCDateTime(), nullable=False, server_default=utcnow(), onupdate=utcnow())
+
+    # Short-lived claim by one device so concurrent study sessions get disjoint due cards
+    lease_owner: Mapped[str | None] = mapped_column(String, nullable=True)
+    lease_expires_at: Mapped[datetime | None] = mapped_column(UTCDateTime(), nullable=True)
+
+    # Copied from another deck by a carry clone rather than created by learning the card,
+    # so it doesn't count as a new card in the daily stats
+    is_carried: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="0")
 
     # Relationships
     card: Mapped["Card"] = relationship(back_populates="schedule")
@@ -89,11 +123,11 @@ class ReviewHistory(Base):
     card_id: Mapped[int] = mapped_column(Integer, ForeignKey("cards.id", ondelete="CASCADE"), nullable=False)
 
     # History for deterministic reproducibility
-    reviewed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    reviewed_at: Mapped[datetime] = mapped_column(UTCDateTime(), nullable=False, server_default=utcnow())
     quality: Mapped[int] = mapped_column(Integer, nullable=False)
 
     # Sorted card review history
-    __table_args__ = (Index("ix_review_history_card_id_reviewed_at_desc", "card_id", reviewed_at.desc()),)
+    __table_args__ = (Index("ix_review_history_card_id_reviewed_at_desc", "card_id", reviewed_at.desc()), {"sqlite_autoincrement": True})
 
     # Nice to haves
     repetition_before: Mapped[int] = mapped_column(Integer, nullable=False)
@@ -102,7 +136,52 @@ class ReviewHistory(Base):
     repetition_after: Mapped[int] = mapped_column(Integer, nullable=False)
     interval_after: Mapped[int] = mapped_column(Integer, nullable=False)
     ease_after: Mapped[float] = mapped_column(Float, nullable=False)
-    next_review_at_after: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    next_review_at_after: Mapped[datetime] = mapped_column(UTCDateTime(), nullable=False)
+
+    # Days load balancing moved the interval by, replayed as-is so rebuilds stay reproducible
+    fuzz_days: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
 
     # Relationships
-    card: Mapped["Card"] = relationship(back_populates="review_history")
\ No newline at end of file
+    card: Mapped["Card"] = relationship(back_populates="review_history")
+
+
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+
+    # Per-user monotonic sequence, allocated from users.change_seq
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    # What changed: entity is "deck", "card" or "schedule", op is "upsert" or "delete"
+    entity: Mapped[str] = mapped_column(String, nullable=False)
+    entity_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    op: Mapped[str] = mapped_column(String, nullable=False)
+
+    # Owning deck for card/schedule entries so a deck tombstone can compact them.
+    # Not a foreign key, entries must outlive the deck they point at.
+    deck_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(UTCDateTime(), nullable=False, server_default=utcnow())
+
+    # Lookups used when newer entries supersede older ones
+    __table_args__ = (
+        Index("ix_change_log_user_entity", "user_id", "entity", "entity_id"),
+        Index("ix_change_log_user_deck", "user_id", "deck_id"),
+    )
+
+
+class DailyReviewStats(Base):
+    __tablename__ = "daily_review_stats"
+
+    # One row per user, deck and UTC day, upserted in the review/learn transactions
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    deck_id: Mapped[int] = mapped_column(Integer, ForeignKey("decks.id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+
+    reviews: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # Reviews with quality < 3
+    failures: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    new_cards: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    # Account-wide ranges across all decks
+    __table_args__ = (Index("ix_daily_review_stats_user_day", "user_id", "day"),)
\ No newline at end of file
@@ -0,0 +1,188 @@
+from .config import PROFILE_SAMPLE_RATE, PROFILE_TOKEN, PROFILE_DIR
+
+import contextvars
+import hmac
+import json
+import queue
+import random
+import selectors
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+
+
+# 200 samples a second, cheap enough to leave on for a sampled fraction of production traffic
+SAMPLE_INTERVAL_SECONDS = 0.005
+
+PROFILE_HEADER = b"x-profile"
+
+# Profile of the request running in the current context, copied into the threadpool with it
+_current_profile: contextvars.ContextVar["RequestProfile | None"] = contextvars.ContextVar("current_profile", default=None)
+
+# Sync routes run on threadpool threads. A thread belongs to the request whose SQL it last ran.
+_thread_owners: dict[int, "RequestProfile"] = {}
+
+
+def _frame_label(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}"
+
+
+def _is_idle(frame) -> bool:
+    # Event loop waiting for I/O, or a pool thread waiting for its next job
+    if frame.f_code.co_filename == selectors.__file__:
+        return True
+    while frame is not None:
+        if frame.f_code.co_filename == queue.__file__ and frame.f_code.co_name == "get":
+            return True
+        frame = frame.f_back
+    return False
+
+
+def fold_stack(frame) -> str:
+    # Root first, the format flamegraph.pl and speedscope read
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.status = None
+        self.loop_thread = threading.get_ident()
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.statements: list[dict] = []
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name=f"profile-{self.id}", daemon=True)
+
+    def threads(self) -> set[int]:
+        return {self.loop_thread} | {thread for thread, owner in list(_thread_owners.items()) if owner is self}
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL_SECONDS):
+            frames = sys._current_frames()
+            for thread in self.threads():
+                frame = frames.get(thread)
+                if frame is None or _is_idle(frame):
+                    continue
+                self.stacks[fold_stack(frame)] += 1
+                self.samples += 1
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+        self._stop.set()
+        self._sampler.join()
+        for thread in [thread for thread, owner in list(_thread_owners.items()) if owner is self]:
+            _thread_owners.pop(thread, None)
+
+    def write(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{self.id}"
+
+        folded = "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+        (directory / f"{name}.folded").write_text(folded)
+
+        summary = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "duration_ms": round(self.duration * 1000, 3),
+            "sample_interval_ms": SAMPLE_INTERVAL_SECONDS * 1000,
+            "samples": self.samples,
+            "sql_ms": round(sum(s["duration_ms"] for s in self.statements), 3),
+            "sql": self.statements,
+        }
+        (directory / f"{name}.json").write_text(json.dumps(summary, indent=2))
+
+
+# --- SQL timing ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is None:
+        _thread_owners.pop(threading.get_ident(), None)
+        return
+    _thread_owners[threading.get_ident()] = profile
+    conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is None:
+        return
+    started = conn.info["profile_query_start"].pop()
+    # Statements only, bound parameters can hold user content
+    profile.statements.append({
+        "statement": statement,
+        "executemany": executemany,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+    })
+
+
+def install_sql_timing():
+    # On the Engine class, so the primary, replica and rate-limit engines are all covered
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# --- Middleware ---
+
+def profiling_enabled() -> bool:
+    return PROFILE_SAMPLE_RATE > 0 or bool(PROFILE_TOKEN)
+
+
+class ProfilingMiddleware:
+    # Only added to the app when profiling is configured, otherwise requests never pass through it
+    def __init__(self, app, token: str = PROFILE_TOKEN, sample_rate: float = PROFILE_SAMPLE_RATE, directory: str = PROFILE_DIR):
+        self.app = app
+        self.token = token.encode()
+        self.sample_rate = sample_rate
+        self.directory = Path(directory)
+        install_sql_timing()
+
+    def selected(self, scope) -> bool:
+        if self.token:
+            header = dict(scope["headers"]).get(PROFILE_HEADER)
+            if header is not None and hmac.compare_digest(header, self.token):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.selected(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        token = _current_profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.stop()
+            _current_profile.reset(token)
+            await run_in_threadpool(profile.write, self.directory)
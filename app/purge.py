@@ -0,0 +1,93 @@
+import argparse
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .dialects import utcnow
+from .models import User, Deck, Card
+
+
+# Decks/accounts with more cards than this are soft-deleted and purged in the background
+SOFT_DELETE_CARD_THRESHOLD = 5000
+
+# Cards removed per purge transaction. Schedules and history go with them via ON DELETE CASCADE
+PURGE_CHUNK_SIZE = 1000
+
+
+def exceeds_soft_delete_threshold(db: Session, *filters) -> bool:
+    # Bounded probe instead of a full count, stops after the threshold is passed
+    probe = (
+        db.query(Card.id)
+        .join(Deck, Card.deck_id == Deck.id)
+        .filter(*filters)
+        .offset(SOFT_DELETE_CARD_THRESHOLD)
+        .limit(1)
+        .first()
+    )
+    return probe is not None
+
+
+def purge_deck(bind: Engine, deck_id: int) -> int:
+    purged = 0
+
+    # Each chunk is its own short transaction so locks and WAL stay bounded
+    while True:
+        chunk = select(Card.id).where(Card.deck_id == deck_id).order_by(Card.id).limit(PURGE_CHUNK_SIZE)
+        with bind.begin() as conn:
+            deleted = conn.execute(delete(Card).where(Card.id.in_(chunk.scalar_subquery()))).rowcount
+        if not deleted:
+            break
+        purged += deleted
+
+    with bind.begin() as conn:
+        conn.execute(delete(Deck).where(Deck.id == deck_id, Deck.deleted_at.is_not(None)))
+
+    return purged
+
+
+def purge_user(bind: Engine, user_id: int) -> int:
+    # Mark every deck of the account, including any created after soft deletion
+    with bind.begin() as conn:
+        conn.execute(update(Deck).where(Deck.user_id == user_id, Deck.deleted_at.is_(None)).values(deleted_at=utcnow()))
+        deck_ids = conn.execute(select(Deck.id).where(Deck.user_id == user_id)).scalars().all()
+
+    purged = 0
+    for deck_id in deck_ids:
+        purged += purge_deck(bind, deck_id)
+
+    with bind.begin() as conn:
+        conn.execute(delete(User).where(User.id == user_id, User.deleted_at.is_not(None)))
+
+    return purged
+
+
+def purge_deleted(bind: Engine) -> int:
+    # Sweep anything a crashed or restarted worker left behind
+    with bind.connect() as conn:
+        user_ids = conn.execute(select(User.id).where(User.deleted_at.is_not(None))).scalars().all()
+        deck_ids = conn.execute(
+            select(Deck.id)
+            .join(User, Deck.user_id == User.id)
+            .where(Deck.deleted_at.is_not(None), User.deleted_at.is_(None))
+        ).scalars().all()
+
+    purged = 0
+    for deck_id in deck_ids:
+        purged += purge_deck(bind, deck_id)
+    for user_id in user_ids:
+        purged += purge_user(bind, user_id)
+    return purged
+
+
+def main():
+    argparse.ArgumentParser(description="Purge soft-deleted decks and accounts in chunks.").parse_args()
+
+    from .database import engine
+
+    purged = purge_deleted(engine)
+    print(f"Purged {purged} cards")
+
+
+if __name__ == "__main__":
+    main()
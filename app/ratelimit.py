@@ -0,0 +1,319 @@
+from .config import (
+    DATABASE_URL, RATE_LIMIT_ENABLED, RATE_LIMIT_BACKEND, RATE_LIMIT_POOL_SIZE,
+    ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_POOL_WAITERS,
+)
+from .database import create_db_engine
+from .security import client_key, client_address_key
+
+import json
+import math
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+from starlette import status
+from starlette.requests import HTTPConnection
+from starlette.types import Receive, Send
+
+
+# Per route class: (bucket capacity, tokens refilled per second)
+ROUTE_LIMITS = {
+    # bcrypt routes, a few attempts per account then one every 12 seconds
+    "auth": (5, 5 / 60),
+    # and a cap on bcrypt work per address across all accounts, roomy enough for a small office behind NAT
+    "auth_address": (30, 0.5),
+    "review": (30, 5.0),
+    "default": (60, 20.0),
+}
+
+MAX_MEMORY_BUCKETS = 100_000
+IDLE_BUCKET_SECONDS = 3600
+
+AUTH_ROUTES = {("POST", "/login"), ("POST", "/signup"), ("DELETE", "/users/me")}
+REVIEW_ROUTE = re.compile(r"^/cards/\d+/review$")
+
+
+def route_class(method: str, path: str) -> str:
+    if (method, path) in AUTH_ROUTES:
+        return "auth"
+    if method == "POST" and REVIEW_ROUTE.match(path):
+        return "review"
+    return "default"
+
+
+def auth_key(request: Request, body: bytes) -> str:
+    # bcrypt routes: no token before login, so the address plus the account being tried.
+    # The address alone would put every user behind one proxy in a single bucket.
+    account = ""
+    try:
+        payload = json.loads(body)
+        if isinstance(payload, dict) and isinstance(payload.get("email"), str):
+            account = f"email:{payload['email'].strip().lower()}"
+    except ValueError:
+        pass
+    if not account and request.headers.get("authorization"):
+        account = client_key(request)
+    return f"{client_address_key(request)}:{account}"
+
+
+def take_token(tokens: float, updated_at: float, now: float, capacity: float, rate: float) -> tuple[float, float]:
+    # Refill for the time elapsed, then spend one token if there is one.
+    # Returns the new token count and 0, or the unchanged count and seconds until the next token.
+    tokens = min(capacity, tokens + (now - updated_at) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class RateLimitBackend(ABC):
+    # Whether take() does I/O and must run off the event loop
+    blocking = False
+
+    @abstractmethod
+    def take(self, key: str, capacity: float, rate: float) -> float:
+        ...
+
+    # Wall-clock timestamps shared the same way as the buckets, e.g. a user's last
+    # write for replica stickiness
+    @abstractmethod
+    def mark(self, key: str):
+        ...
+
+    @abstractmethod
+    def marked_at(self, key: str) -> float | None:
+        ...
+
+    def dispose(self, close: bool = True):
+        pass
+
+
+class MemoryBackend(RateLimitBackend):
+    def __init__(self):
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._marks: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens, retry_after = take_token(tokens, updated_at, now, capacity, rate)
+            self._buckets[key] = (tokens, now)
+
+            # Keep memory bounded, buckets idle this long have refilled anyway
+            if len(self._buckets) > MAX_MEMORY_BUCKETS:
+                self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < IDLE_BUCKET_SECONDS}
+        return retry_after
+
+    def mark(self, key: str):
+        now = time.time()
+        with self._lock:
+            self._marks[key] = now
+            if len(self._marks) > MAX_MEMORY_BUCKETS:
+                self._marks = {k: v for k, v in self._marks.items() if now - v < IDLE_BUCKET_SECONDS}
+
+    def marked_at(self, key: str) -> float | None:
+        return self._marks.get(key)
+
+
+class DatabaseBackend(RateLimitBackend):
+    blocking = True
+
+    def __init__(self, bind: Engine):
+        self.bind = bind
+
+        # On SQLite the INSERT below takes the write lock before the read, which stands in for FOR UPDATE
+        postgres = bind.dialect.name == "postgresql"
+        self._lock_clause = " FOR UPDATE" if postgres else ""
+
+        with self.bind.begin() as conn:
+            # Unlogged: bucket state is disposable and should not cost WAL writes
+            conn.execute(text(
+                f"CREATE {'UNLOGGED ' if postgres else ''}TABLE IF NOT EXISTS rate_limit_buckets ("
+                "key text PRIMARY KEY, tokens double precision NOT NULL, updated_at double precision NOT NULL)"
+            ))
+            conn.execute(text(
+                f"CREATE {'UNLOGGED ' if postgres else ''}TABLE IF NOT EXISTS rate_limit_marks ("
+                "key text PRIMARY KEY, marked_at double precision NOT NULL)"
+            ))
+
+    def take(self, key: str, capacity: float, rate: float) -> float:
+        now = time.time()
+        with self.bind.begin() as conn:
+            conn.execute(
+                text("INSERT INTO rate_limit_buckets (key, tokens, updated_at) VALUES (:key, :tokens, :now) ON CONFLICT (key) DO NOTHING"),
+                {"key": key, "tokens": capacity, "now": now},
+            )
+            tokens, updated_at = conn.execute(
+                text(f"SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = :key{self._lock_clause}"),
+                {"key": key},
+            ).one()
+            tokens, retry_after = take_token(tokens, updated_at, now, capacity, rate)
+            conn.execute(
+                text("UPDATE rate_limit_buckets SET tokens = :tokens, updated_at = :now WHERE key = :key"),
+                {"key": key, "tokens": tokens, "now": now},
+            )
+        return retry_after
+
+    def mark(self, key: str):
+        with self.bind.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO rate_limit_marks (key, marked_at) VALUES (:key, :now) "
+                    "ON CONFLICT (key) DO UPDATE SET marked_at = excluded.marked_at"
+                ),
+                {"key": key, "now": time.time()},
+            )
+
+    def marked_at(self, key: str) -> float | None:
+        with self.bind.connect() as conn:
+            return conn.execute(text("SELECT marked_at FROM rate_limit_marks WHERE key = :key"), {"key": key}).scalar()
+
+    def dispose(self, close: bool = True):
+        self.bind.dispose(close=close)
+
+
+class RateLimiter:
+    def __init__(self, backend: RateLimitBackend, pool_engine: Engine | None = None, enabled: bool = True):
+        self.backend = backend
+        self.pool_engine = pool_engine
+        self.enabled = enabled
+        self.limits = dict(ROUTE_LIMITS)
+        self.max_in_flight = ADMISSION_MAX_IN_FLIGHT
+        self.max_pool_waiters = ADMISSION_MAX_POOL_WAITERS
+        self.in_flight = 0
+
+    def pool_waiters(self) -> int:
+        # Requests in flight beyond the connections the pool can hand out are queued on it
+        if self.pool_engine is None:
+            return 0
+        pool = self.pool_engine.pool
+        if not hasattr(pool, "checkedout"):
+            return 0
+        capacity = pool.size() + max(getattr(pool, "_max_overflow", 0), 0)
+        if pool.checkedout() < capacity:
+            return 0
+        return max(self.in_flight - capacity, 0)
+
+    def admission_retry_after(self) -> float:
+        if self.in_flight >= self.max_in_flight or self.pool_waiters() >= self.max_pool_waiters:
+            return 1.0
+        return 0.0
+
+    async def take(self, route: str, client: str) -> float:
+        # Spends a token from the client's bucket for the route class, 0 or seconds until the next token
+        capacity, rate = self.limits[route]
+        key = f"{route}:{client}"
+
+        if self.backend.blocking:
+            return await run_in_threadpool(self.backend.take, key, capacity, rate)
+        return self.backend.take(key, capacity, rate)
+
+    async def rate_limit_retry_after(self, request: Request, body: bytes = b"") -> float:
+        route = route_class(request.method, request.url.path)
+        if route != "auth":
+            return await self.take(route, client_key(request))
+
+        # Rotating emails gets a fresh account bucket each time, the address bucket still drains
+        retry_after = await self.take("auth_address", client_address_key(request))
+        if retry_after:
+            return retry_after
+        return await self.take(route, auth_key(request, body))
+
+
+def _retry_response(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+async def _close_websocket(send: Send, code: int, reason: str):
+    # Rejects the handshake before the app accepts it
+    await send({"type": "websocket.close", "code": code, "reason": reason})
+
+
+async def buffer_body(receive: Receive) -> tuple[bytes, Receive]:
+    # Reads the whole request body and returns it with a receive that replays it to the app
+    messages = []
+    body = b""
+    while True:
+        message = await receive()
+        messages.append(message)
+        if message["type"] != "http.request":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+
+    async def replay():
+        if messages:
+            return messages.pop(0)
+        return await receive()
+
+    return body, replay
+
+
+class RateLimitMiddleware:
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or not self.limiter.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        websocket = scope["type"] == "websocket"
+
+        # Shed load before it reaches the database pool
+        retry_after = self.limiter.admission_retry_after()
+        if retry_after:
+            if websocket:
+                await _close_websocket(send, status.WS_1013_TRY_AGAIN_LATER, "Server is busy, try again shortly")
+            else:
+                await _retry_response(503, "Server is busy, try again shortly", retry_after)(scope, receive, send)
+            return
+
+        if websocket:
+            # The handshake spends a default token, grades on the open socket are limited by the route
+            retry_after = await self.limiter.take("default", client_key(HTTPConnection(scope)))
+        else:
+            request = Request(scope)
+
+            # Auth routes are keyed by the submitted email, only their small bodies are read here
+            body = b""
+            if route_class(request.method, request.url.path) == "auth":
+                body, receive = await buffer_body(receive)
+            retry_after = await self.limiter.rate_limit_retry_after(request, body)
+        if retry_after:
+            if websocket:
+                await _close_websocket(send, status.WS_1008_POLICY_VIOLATION, "Too many requests")
+            else:
+                await _retry_response(429, "Too many requests", retry_after)(scope, receive, send)
+            return
+
+        # An open socket holds its database session, it counts for as long as it stays open
+        self.limiter.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.in_flight -= 1
+
+
+def create_limiter(pool_engine: Engine) -> RateLimiter:
+    if RATE_LIMIT_BACKEND == "database":
+        # Own small pool so limiter traffic never competes with request traffic
+        backend = DatabaseBackend(create_db_engine(DATABASE_URL, pool_size=RATE_LIMIT_POOL_SIZE, max_overflow=0))
+    elif RATE_LIMIT_BACKEND == "memory":
+        backend = MemoryBackend()
+    else:
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {RATE_LIMIT_BACKEND}")
+    return RateLimiter(backend, pool_engine, enabled=RATE_LIMIT_ENABLED)
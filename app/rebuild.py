@@ -0,0 +1,266 @@
+import argparse
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+from sqlalchemy import bindparam, select, update, values, column, Integer, Float
+from sqlalchemy.engine import Connection, Engine
+
+from .database import create_db_engine
+from .dialects import UTCDateTime
+from .models import Deck, CardSchedule, ReviewHistory
+from .changelog import record_changes, ENTITY_SCHEDULE, OP_UPSERT
+from .sm2 import sm2_update
+
+
+# Rows fetched per round trip from the server-side cursor
+STREAM_BATCH_SIZE = 5000
+
+# Schedules written per UPDATE ... FROM VALUES statement
+WRITE_BATCH_SIZE = 1000
+
+SCHEDULE_FIELDS = ("repetition_count", "interval_days", "ease_factor", "next_review_at", "last_reviewed_at")
+
+# Each write also carries the last_reviewed_at the stream read. The update only lands
+# while the schedule still has it, so a review committed after the read wins, whether
+# or not its history row has been written yet.
+WRITE_FIELDS = ("card_id",) + SCHEDULE_FIELDS + ("stored_last_reviewed_at",)
+
+
+def _scope_filters(deck_id: int | None, user_id: int | None) -> list:
+    filters = []
+    if deck_id is not None:
+        filters.append(CardSchedule.deck_id == deck_id)
+    if user_id is not None:
+        filters.append(Deck.user_id == user_id)
+    return filters
+
+
+def _replay(reviews) -> dict:
+    # Start from the state the first review saw. That is the learn_card state for most
+    # cards, but a deck cloned with its schedules starts where the source card was.
+    first = reviews[0]
+    state = {
+        "repetition_count": first.repetition_before,
+        "interval_days": first.interval_before,
+        "ease_factor": first.ease_before,
+        "next_review_at": None,
+        "last_reviewed_at": None,
+    }
+
+    # Reviews arrive in reviewed_at order, feed each one through the scheduler
+    for review in reviews:
+        updated_vals = sm2_update(
+            state["repetition_count"],
+            state["interval_days"],
+            state["ease_factor"],
+            review.quality,
+            review.reviewed_at,
+            review.fuzz_days,
+        )
+        state.update(updated_vals)
+        state["last_reviewed_at"] = review.reviewed_at
+
+    return state
+
+
+def _diff(stored, replayed: dict) -> dict:
+    fields = {}
+    for name in SCHEDULE_FIELDS:
+        stored_value = getattr(stored, name)
+        replayed_value = replayed[name]
+        if name == "ease_factor":
+            same = math.isclose(stored_value, replayed_value, rel_tol=1e-9)
+        else:
+            same = stored_value == replayed_value
+        if not same:
+            fields[name] = {"stored": stored_value, "replayed": replayed_value}
+    return fields
+
+
+def _write_schedules_sqlite(conn: Connection, rows: list[dict]) -> list[int]:
+    # SQLite can't alias VALUES columns, run the same guarded update once per card
+    stmt = (
+        update(CardSchedule)
+        .where(CardSchedule.card_id == bindparam("b_card_id"))
+        .where(CardSchedule.last_reviewed_at.is_not_distinct_from(bindparam("b_stored_last_reviewed_at", type_=UTCDateTime())))
+        .values(**{name: bindparam(f"b_{name}") for name in SCHEDULE_FIELDS})
+    )
+    return [
+        row["card_id"] for row in rows
+        if conn.execute(stmt, {f"b_{name}": row[name] for name in WRITE_FIELDS}).rowcount
+    ]
+
+
+def _record_schedule_changes(conn: Connection, rows: list[dict], card_ids: list[int]):
+    # Sync clients pick up the repaired schedules like any other schedule write.
+    # Owners in user order so concurrent rebuild workers lock users the same way.
+    owners = {row["card_id"]: (row["user_id"], row["deck_id"]) for row in rows}
+    by_owner = {}
+    for card_id in sorted(card_ids):
+        by_owner.setdefault(owners[card_id], []).append(card_id)
+    for (user_id, deck_id), owned in sorted(by_owner.items()):
+        record_changes(conn, user_id, ENTITY_SCHEDULE, owned, OP_UPSERT, deck_id)
+
+
+def _write_schedules_postgresql(conn: Connection, rows: list[dict]) -> list[int]:
+    v = values(
+        column("card_id", Integer),
+        column("repetition_count", Integer),
+        column("interval_days", Integer),
+        column("ease_factor", Float),
+        column("next_review_at", UTCDateTime()),
+        column("last_reviewed_at", UTCDateTime()),
+        column("stored_last_reviewed_at", UTCDateTime()),
+        name="v",
+    ).data([tuple(row[name] for name in WRITE_FIELDS) for row in rows])
+
+    stmt = (
+        update(CardSchedule)
+        .where(CardSchedule.card_id == v.c.card_id)
+        .where(CardSchedule.last_reviewed_at.is_not_distinct_from(v.c.stored_last_reviewed_at))
+        .values(
+            repetition_count=v.c.repetition_count,
+            interval_days=v.c.interval_days,
+            ease_factor=v.c.ease_factor,
+            next_review_at=v.c.next_review_at,
+            last_reviewed_at=v.c.last_reviewed_at,
+        )
+        .returning(CardSchedule.card_id)
+    )
+    return conn.execute(stmt).scalars().all()
+
+
+def _write_schedules(bind: Engine, rows: list[dict]) -> int:
+    # Schedules and their change log entries commit together, one transaction per batch
+    with bind.begin() as conn:
+        if bind.dialect.name == "sqlite":
+            card_ids = _write_schedules_sqlite(conn, rows)
+        else:
+            card_ids = _write_schedules_postgresql(conn, rows)
+        _record_schedule_changes(conn, rows, card_ids)
+    return len(card_ids)
+
+
+def rebuild_schedules(
+    bind: Engine,
+    deck_id: int | None = None,
+    user_id: int | None = None,
+    dry_run: bool = False,
+    workers: int = 1,
+) -> dict:
+    # Spread decks across a process pool, each process opens its own engine
+    if workers > 1 and deck_id is None:
+        return _rebuild_parallel(bind, user_id, dry_run, workers)
+
+    report = {"cards_replayed": 0, "cards_updated": 0, "divergent": [], "pending_history": []}
+
+    # Only learned cards with at least one review can be replayed
+    stmt = (
+        select(
+            ReviewHistory.card_id,
+            ReviewHistory.reviewed_at,
+            ReviewHistory.quality,
+            ReviewHistory.fuzz_days,
+            ReviewHistory.repetition_before,
+            ReviewHistory.interval_before,
+            ReviewHistory.ease_before,
+            CardSchedule.repetition_count,
+            CardSchedule.interval_days,
+            CardSchedule.ease_factor,
+            CardSchedule.next_review_at,
+            CardSchedule.last_reviewed_at,
+            CardSchedule.deck_id,
+            Deck.user_id,
+        )
+        .join(CardSchedule, CardSchedule.card_id == ReviewHistory.card_id)
+        .join(Deck, Deck.id == CardSchedule.deck_id)
+        .where(*_scope_filters(deck_id, user_id))
+        .order_by(ReviewHistory.card_id, ReviewHistory.reviewed_at, ReviewHistory.id)
+    )
+
+    pending = []
+
+    # Stream through a server-side cursor so memory stays bounded by one card's history
+    with bind.connect() as conn:
+        result = conn.execution_options(yield_per=STREAM_BATCH_SIZE).execute(stmt)
+
+        for card_id, reviews in groupby(result, key=lambda row: row.card_id):
+            reviews = list(reviews)
+            stored = reviews[-1]
+
+            # The schedule moved past the newest history row, so that review's row is
+            # still in the write-behind buffer. Replaying now would roll the schedule back.
+            if stored.last_reviewed_at is not None and stored.last_reviewed_at > stored.reviewed_at:
+                report["pending_history"].append(card_id)
+                continue
+
+            replayed = _replay(reviews)
+            report["cards_replayed"] += 1
+
+            fields = _diff(stored, replayed)
+            if not fields:
+                continue
+
+            report["divergent"].append({"card_id": card_id, "fields": fields})
+            pending.append({
+                "card_id": card_id,
+                **replayed,
+                "stored_last_reviewed_at": stored.last_reviewed_at,
+                "user_id": stored.user_id,
+                "deck_id": stored.deck_id,
+            })
+
+            if not dry_run and len(pending) >= WRITE_BATCH_SIZE:
+                report["cards_updated"] += _write_schedules(bind, pending)
+                pending = []
+
+    if not dry_run and pending:
+        report["cards_updated"] += _write_schedules(bind, pending)
+
+    return report
+
+
+def _rebuild_deck_in_process(url: str, deck_id: int, dry_run: bool) -> dict:
+    engine = create_db_engine(url)
+    try:
+        return rebuild_schedules(engine, deck_id=deck_id, dry_run=dry_run)
+    finally:
+        engine.dispose()
+
+
+def _rebuild_parallel(bind: Engine, user_id: int | None, dry_run: bool, workers: int) -> dict:
+    with bind.connect() as conn:
+        deck_ids = conn.execute(select(Deck.id).where(*_scope_filters(None, user_id)).order_by(Deck.id)).scalars().all()
+
+    report = {"cards_replayed": 0, "cards_updated": 0, "divergent": [], "pending_history": []}
+    url = bind.url.render_as_string(hide_password=False)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for deck_report in pool.map(_rebuild_deck_in_process, [url] * len(deck_ids), deck_ids, [dry_run] * len(deck_ids)):
+            report["cards_replayed"] += deck_report["cards_replayed"]
+            report["cards_updated"] += deck_report["cards_updated"]
+            report["divergent"].extend(deck_report["divergent"])
+            report["pending_history"].extend(deck_report["pending_history"])
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild card schedules by replaying review history.")
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument("--deck-id", type=int)
+    scope.add_argument("--user-id", type=int)
+    parser.add_argument("--dry-run", action="store_true", help="Report divergent cards without writing")
+    parser.add_argument("--workers", type=int, default=1, help="Processes to spread decks across")
+    args = parser.parse_args()
+
+    from .database import engine
+
+    report = rebuild_schedules(engine, deck_id=args.deck_id, user_id=args.user_id, dry_run=args.dry_run, workers=args.workers)
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+from .config import REVIEW_WRITE_PATH, SCHEDULE_FUZZ_ENABLED
+from fastapi import HTTPException, status
+
+import functools
+from datetime import datetime, time, timedelta, UTC
+
+from sqlalchemy import select, update, insert, bindparam, func, literal, Integer
+from sqlalchemy.orm import Session
+
+from .dialects import dialect_name, utc_date, utcnow
+from .models import Deck, Card, CardSchedule, ReviewHistory
+from .sm2 import sm2_update, sm2_update_sql, fuzz_spread, choose_fuzz
+
+
+def _not_found():
+    # We don't know if the card ID is wrong OR if the card is just not learned yet
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="Card not found or not learned."
+    )
+
+
+def _already_reviewed():
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Card was already reviewed and is no longer due."
+    )
+
+
+def _due_counts(db: Session, deck_id: int, due_at: datetime, spread: int) -> dict[int, int]:
+    # Cards due per UTC day within spread days of due_at, keyed by day offset (index-driven)
+    base = due_at.astimezone(UTC).date()
+    start = datetime.combine(base - timedelta(days=spread), time(), UTC)
+    end = datetime.combine(base + timedelta(days=spread + 1), time(), UTC)
+
+    day = utc_date(CardSchedule.next_review_at)
+    rows = db.execute(
+        select(day, func.count())
+        .where(CardSchedule.deck_id == deck_id)
+        .where(CardSchedule.next_review_at >= start, CardSchedule.next_review_at < end)
+        .group_by(day)
+    ).all()
+    return {(due_day - base).days: count for due_day, count in rows}
+
+
+def review_with_orm(db: Session, user_id: int, card_id: int, quality: int, defer_history: bool = False) -> dict:
+    # Fetch card schedule + enforce ownership via deck. Lock schedule to ensure
+    # one review will always map to one history being created (race condition)
+    result = (
+        db.query(CardSchedule, utcnow())
+        .join(Card, CardSchedule.card_id == Card.id)
+        .join(Deck, Card.deck_id == Deck.id)
+        .filter(Card.id == card_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
+        .with_for_update(of=CardSchedule)
+        .first()
+        )
+    if not result:
+        raise _not_found()
+
+    # Unpack the tuple: (CardSchedule object, datetime object)
+    schedule, db_now = result
+
+    # If a previous request just completed and the schedule is now unlocked,
+    # another race condition is possible where the schedule could accidentally get
+    # updated (reviewed) twice. Ensure the card is actually still due.
+    if schedule.next_review_at > db_now:
+        raise _already_reviewed()
+
+    # Get current schedule values
+    repetition_before = schedule.repetition_count
+    interval_before = schedule.interval_days
+    ease_before = schedule.ease_factor
+    timestamp = db_now
+
+    # Get new values from sm-2 algo
+    updated_vals = sm2_update(
+        repetition_before,
+        interval_before,
+        ease_before,
+        quality,
+        timestamp,
+    )
+
+    # Move long intervals toward the lightest nearby day of this deck
+    fuzz_days = 0
+    spread = fuzz_spread(updated_vals["interval_days"])
+    if SCHEDULE_FUZZ_ENABLED and spread:
+        due_counts = _due_counts(db, schedule.deck_id, updated_vals["next_review_at"], spread)
+        fuzz_days = choose_fuzz(card_id, repetition_before, updated_vals["interval_days"], due_counts)
+        updated_vals = sm2_update(repetition_before, interval_before, ease_before, quality, timestamp, fuzz_days)
+
+    # Update to new card schedule values
+    schedule.repetition_count = updated_vals["repetition_count"]
+    schedule.interval_days = updated_vals["interval_days"]
+    schedule.ease_factor = updated_vals["ease_factor"]
+    schedule.next_review_at = updated_vals["next_review_at"]
+    schedule.last_reviewed_at = timestamp
+
+    # Reviewed cards are no longer held by any device
+    schedule.lease_owner = None
+    schedule.lease_expires_at = None
+
+    # Create history for the review
+    history = dict(
+        card_id=card_id,
+        reviewed_at=timestamp,
+        quality=quality,
+        repetition_before=repetition_before,
+        interval_before=interval_before,
+        ease_before=ease_before,
+        repetition_after=schedule.repetition_count,
+        interval_after=schedule.interval_days,
+        ease_after=schedule.ease_factor,
+        next_review_at_after=schedule.next_review_at,
+        fuzz_days=fuzz_days,
+    )
+
+    result = {"card_id": card_id, "deck_id": schedule.deck_id, "reviewed_at": timestamp, **updated_vals}
+    if defer_history:
+        result["history"] = history
+    else:
+        db.add(ReviewHistory(**history))
+    return result
+
+
+@functools.cache
+def _review_cte_statement(with_history: bool = True):
+    # Built once and executed with bound values, constructing and cache-keying a
+    # statement this size per request would cost more than the round trips it saves.
+    # Names must not collide with column names, the nested DML would read them as column values
+    card_id = bindparam("review_card_id", type_=Integer)
+    user_id = bindparam("review_user_id", type_=Integer)
+    quality = bindparam("review_quality", type_=Integer)
+
+    # Lock the schedule + enforce ownership via deck. A concurrent review of the same
+    # card blocks here, and once it commits this row is re-read at its new version.
+    locked = (
+        select(
+            CardSchedule.card_id,
+            CardSchedule.deck_id,
+            CardSchedule.repetition_count,
+            CardSchedule.interval_days,
+            CardSchedule.ease_factor,
+            utcnow().label("reviewed_at"),
+        )
+        .join(Card, CardSchedule.card_id == Card.id)
+        .join(Deck, Card.deck_id == Deck.id)
+        .where(Card.id == card_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
+        .with_for_update(of=CardSchedule)
+        .cte("locked")
+    )
+
+    updated_vals = sm2_update_sql(
+        locked.c.repetition_count,
+        locked.c.interval_days,
+        locked.c.ease_factor,
+        quality,
+        locked.c.reviewed_at,
+    )
+
+    # Only still-due schedules are updated, which closes the double-review race
+    updated = (
+        update(CardSchedule)
+        .where(CardSchedule.card_id == locked.c.card_id)
+        .where(CardSchedule.next_review_at <= locked.c.reviewed_at)
+        .values(
+            **updated_vals,
+            last_reviewed_at=locked.c.reviewed_at,
+            lease_owner=None,
+            lease_expires_at=None,
+        )
+        .returning(
+            CardSchedule.card_id,
+            CardSchedule.repetition_count,
+            CardSchedule.interval_days,
+            CardSchedule.ease_factor,
+            CardSchedule.next_review_at,
+        )
+        .cte("updated")
+    )
+
+    # History row for exactly the schedule that was updated
+    history = (
+        insert(ReviewHistory)
+        .from_select(
+            [
+                "card_id", "reviewed_at", "quality",
+                "repetition_before", "interval_before", "ease_before",
+                "repetition_after", "interval_after", "ease_after", "next_review_at_after", "fuzz_days",
+            ],
+            select(
+                updated.c.card_id,
+                locked.c.reviewed_at,
+                quality,
+                locked.c.repetition_count,
+                locked.c.interval_days,
+                locked.c.ease_factor,
+                updated.c.repetition_count,
+                updated.c.interval_days,
+                updated.c.ease_factor,
+                updated.c.next_review_at,
+                # This path never load balances
+                literal(0, Integer),
+            ).join_from(updated, locked, updated.c.card_id == locked.c.card_id),
+        )
+        .cte("history")
+    )
+
+    statement = (
+        select(
+            locked.c.deck_id,
+            locked.c.reviewed_at,
+            locked.c.repetition_count.label("repetition_before"),
+            locked.c.interval_days.label("interval_before"),
+            locked.c.ease_factor.label("ease_before"),
+            updated.c.card_id.label("updated_card_id"),
+            updated.c.repetition_count,
+            updated.c.interval_days,
+            updated.c.ease_factor,
+            updated.c.next_review_at,
+        )
+        .outerjoin_from(locked, updated, locked.c.card_id == updated.c.card_id)
+    )
+    # Without it the caller hands the history row to the write-behind buffer
+    if with_history:
+        statement = statement.add_cte(history)
+    return statement
+
+
+def review_with_cte(db: Session, user_id: int, card_id: int, quality: int, defer_history: bool = False) -> dict:
+    result = db.execute(
+        _review_cte_statement(with_history=not defer_history),
+        {"review_card_id": card_id, "review_user_id": user_id, "review_quality": quality},
+    ).first()
+
+    # No locked row -> 404, locked but not updated -> no longer due
+    if not result:
+        raise _not_found()
+    if result.updated_card_id is None:
+        raise _already_reviewed()
+
+    review = {
+        "card_id": card_id,
+        "deck_id": result.deck_id,
+        "reviewed_at": result.reviewed_at,
+        "repetition_count": result.repetition_count,
+        "interval_days": result.interval_days,
+        "ease_factor": result.ease_factor,
+        "next_review_at": result.next_review_at,
+    }
+    if defer_history:
+        review["history"] = dict(
+            card_id=card_id,
+            reviewed_at=result.reviewed_at,
+            quality=quality,
+            repetition_before=result.repetition_before,
+            interval_before=result.interval_before,
+            ease_before=result.ease_before,
+            repetition_after=result.repetition_count,
+            interval_after=result.interval_days,
+            ease_after=result.ease_factor,
+            next_review_at_after=result.next_review_at,
+            fuzz_days=0,
+        )
+    return review
+
+
+def apply_review(db: Session, user_id: int, card_id: int, quality: int, defer_history: bool = False) -> dict:
+    # Single round trip on Postgres, the ORM path stays as the portable fallback
+    # and also handles load balancing, which needs the deck's due counts first.
+    # defer_history: the history row is returned under "history" instead of inserted.
+    if REVIEW_WRITE_PATH == "cte" and not SCHEDULE_FUZZ_ENABLED and dialect_name(db) == "postgresql":
+        return review_with_cte(db, user_id, card_id, quality, defer_history)
+    return review_with_orm(db, user_id, card_id, quality, defer_history)
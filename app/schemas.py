@@ -1,5 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field, ConfigDict
-from typing import Optional
+from typing import Literal, Optional
+from datetime import datetime, date
 
 CARD_FRONT_MIN_LEN = 1
 CARD_FRONT_MAX_LEN = 200
@@ -23,9 +24,25 @@ class DeckCreate(BaseModel):
 class DeckOut(BaseModel):
     id: int
     name: str
+    is_template: bool = False
 
     model_config = ConfigDict(from_attributes=True)
 
+class DeckCloneIn(BaseModel):
+    # Defaults to the source deck's name
+    name: Optional[str] = Field(default=None, min_length=1, max_length=30)
+    # "reset" copies cards as new, "carry" also copies learned state and schedules (own decks only)
+    schedule: Literal["reset", "carry"] = "reset"
+
+class DeckCloneOut(BaseModel):
+    deck: DeckOut
+    cards_copied: int
+
+class TemplateOut(BaseModel):
+    id: int
+    name: str
+    card_count: int
+
 class CardCreate(BaseModel):
     front: str = Field(min_length=CARD_FRONT_MIN_LEN, max_length=CARD_FRONT_MAX_LEN)
     back: str = Field(min_length=CARD_BACK_MIN_LEN, max_length=CARD_BACK_MAX_LEN)
@@ -37,9 +54,84 @@ class CardOut(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+class CardSearchOut(BaseModel):
+    id: int
+    deck_id: int
+    front: str
+    back: str
+    rank: float
+
+    model_config = ConfigDict(from_attributes=True)
+
 class CardUpdate(BaseModel):
     front: Optional[str] = Field(default=None, min_length=CARD_FRONT_MIN_LEN, max_length=CARD_FRONT_MAX_LEN)
     back: Optional[str] = Field(default=None, min_length=CARD_BACK_MIN_LEN, max_length=CARD_BACK_MAX_LEN)
 
 class ReviewIn(BaseModel):
-    quality: int = Field(..., ge=0, le=5)
\ No newline at end of file
+    quality: int = Field(..., ge=0, le=5)
+
+class ReviewHistoryOut(BaseModel):
+    id: int
+    reviewed_at: datetime
+    quality: int
+    repetition_before: int
+    interval_before: int
+    ease_before: float
+    repetition_after: int
+    interval_after: int
+    ease_after: float
+    next_review_at_after: datetime
+
+class CardHistoryPageOut(BaseModel):
+    card_id: int
+    reviews: list[ReviewHistoryOut]
+    # Pass back as ?before= for the next, older page
+    cursor: Optional[int]
+    has_more: bool
+
+class CardRecentHistoryOut(BaseModel):
+    card_id: int
+    reviews: list[ReviewHistoryOut]
+
+class StudyReviewIn(BaseModel):
+    card_id: int
+    quality: int = Field(..., ge=0, le=5)
+
+class DailyStatsOut(BaseModel):
+    day: date
+    reviews: int
+    failures: int
+    new_cards: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+class CardSyncOut(BaseModel):
+    id: int
+    deck_id: int
+    front: str
+    back: str
+    is_learned: bool
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ScheduleOut(BaseModel):
+    card_id: int
+    deck_id: int
+    repetition_count: int
+    interval_days: int
+    ease_factor: float
+    next_review_at: datetime
+    last_reviewed_at: Optional[datetime]
+
+    model_config = ConfigDict(from_attributes=True)
+
+class SyncOut(BaseModel):
+    cursor: int
+    has_more: bool
+    # Cursor is older than the compacted log, client must drop local state and sync from 0
+    reset: bool
+    decks: list[DeckOut]
+    cards: list[CardSyncOut]
+    schedules: list[ScheduleOut]
+    deleted_decks: list[int]
+    deleted_cards: list[int]
\ No newline at end of file
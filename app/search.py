@@ -0,0 +1,108 @@
+from sqlalchemy import DDL, and_, case, event, func, literal, literal_column, or_, select, desc, text
+from sqlalchemy.orm import Session
+
+from .dialects import SEARCH_WORD, dialect_name
+from .models import Card, Deck
+
+
+# Postgres-only search structures, created alongside the cards table. The generated
+# tsvector is not mapped on Card so regular card queries never load it.
+SEARCH_DDL = [
+    "ALTER TABLE cards ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', front), 'A') || setweight(to_tsvector('simple', back), 'B')"
+    ") STORED",
+    "CREATE INDEX ix_cards_search_vector ON cards USING gin (search_vector)",
+]
+
+# Trigram indexes for typo tolerance, only where the pg_trgm extension can be installed
+TRIGRAM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX ix_cards_front_trgm ON cards USING gin (front gin_trgm_ops)",
+    "CREATE INDEX ix_cards_back_trgm ON cards USING gin (back gin_trgm_ops)",
+]
+
+
+def _trigram_available(ddl, target, bind, **kw) -> bool:
+    return bind.exec_driver_sql("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").first() is not None
+
+
+for statement in SEARCH_DDL:
+    event.listen(Card.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+for statement in TRIGRAM_DDL:
+    event.listen(Card.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql", callable_=_trigram_available))
+
+search_vector = literal_column("cards.search_vector")
+
+# Whether pg_trgm is installed, cached per database
+_trigram_installed: dict[str, bool] = {}
+
+
+def trigram_installed(db: Session) -> bool:
+    url = str(db.get_bind().engine.url)
+    if url not in _trigram_installed:
+        installed = db.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+        _trigram_installed[url] = installed is not None
+    return _trigram_installed[url]
+
+
+def search_words(q: str) -> list[str]:
+    return SEARCH_WORD.findall(q.lower())
+
+
+def prefix_tsquery(q: str) -> str | None:
+    # Every word must match, each as a prefix so partially typed words still hit
+    words = search_words(q)
+    if not words:
+        return None
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def _word_prefix_match(column, word: str):
+    # A word of the column starts with the search word. search_text splits the column
+    # into words the way search_words splits the query, punctuation and newlines included.
+    return func.search_text(column).contains(" " + word, autoescape=True)
+
+
+def _sqlite_rank_and_matches(q: str):
+    # No tsvector on SQLite: every word must prefix a word of the front or back,
+    # front hits weigh more like the A/B weights on Postgres
+    words = search_words(q)
+    rank = sum(
+        case((_word_prefix_match(Card.front, word), 1.0), else_=0.0)
+        + case((_word_prefix_match(Card.back, word), 0.4), else_=0.0)
+        for word in words
+    )
+    matches = [and_(*[or_(_word_prefix_match(Card.front, word), _word_prefix_match(Card.back, word)) for word in words])]
+    return rank, matches
+
+
+def search_cards(db: Session, user_id: int, q: str, deck_id: int | None, limit: int, offset: int) -> list:
+    tsquery_text = prefix_tsquery(q)
+    if tsquery_text is None:
+        return []
+
+    if dialect_name(db) == "sqlite":
+        rank, matches = _sqlite_rank_and_matches(q)
+    else:
+        tsquery = func.to_tsquery("simple", tsquery_text)
+
+        # Full-text hits rank first, trigram similarity catches typos on either side
+        rank = func.ts_rank_cd(search_vector, tsquery)
+        matches = [search_vector.op("@@")(tsquery)]
+        if trigram_installed(db):
+            rank = rank + func.greatest(func.similarity(Card.front, q), func.word_similarity(q, Card.back))
+            matches += [Card.front.op("%")(q), literal(q).op("<%")(Card.back)]
+
+    stmt = (
+        select(Card.id, Card.deck_id, Card.front, Card.back, rank.label("rank"))
+        .join(Deck, Card.deck_id == Deck.id)
+        .where(Deck.user_id == user_id, Deck.deleted_at.is_(None))
+        .where(or_(*matches))
+        .order_by(desc("rank"), Card.id.asc())
+        .limit(limit)
+        .offset(offset)
+    )
+    if deck_id is not None:
+        stmt = stmt.where(Card.deck_id == deck_id)
+
+    return db.execute(stmt).all()
@@ -33,4 +33,19 @@ def decode_access_token(token: str) -> int:
             raise ValueError("Token missing sub")
         return int(sub)
     except (JWTError, ValueError):
-        raise ValueError("Invalid token")
\ No newline at end of file
+        raise ValueError("Invalid token")
+
+
+def client_key(request) -> str:
+    # Identify the caller for per-client state: user id from a valid bearer token, else address
+    auth = request.headers.get("authorization", "")
+    if auth.lower().startswith("bearer "):
+        try:
+            return f"user:{decode_access_token(auth[7:])}"
+        except ValueError:
+            pass
+    return client_address_key(request)
+
+
+def client_address_key(request) -> str:
+    return f"addr:{request.client.host if request.client else ''}"
\ No newline at end of file
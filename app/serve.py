@@ -0,0 +1,160 @@
+import argparse
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+
+# Pause before replacing a worker that exited on its own, so a crash loop doesn't spin
+RESPAWN_DELAY_SECONDS = 1.0
+
+# Extra time past the graceful timeout before stragglers are killed
+KILL_GRACE_SECONDS = 5.0
+
+
+def worker_pool_size(db_connections: int, workers: int, reserved_per_worker: int = 0) -> int:
+    # Every worker gets an equal share of the budget, less the connections it holds outside
+    # its request pool. The whole budget is never exceeded, too small a budget is an error.
+    pool_size = db_connections // workers - reserved_per_worker
+    if pool_size < 1:
+        raise ValueError(
+            f"{db_connections} connections can't give {workers} workers a pool each "
+            f"({reserved_per_worker} per worker are reserved for other pools)"
+        )
+    return pool_size
+
+
+def reserved_connections() -> int:
+    # Pools a worker opens next to the request pool: the database rate limit backend's
+    from . import config
+    return config.RATE_LIMIT_POOL_SIZE if config.RATE_LIMIT_BACKEND == "database" else 0
+
+
+def _dispose_engines(close: bool):
+    from .database import engine, replica_engines
+    from .main import limiter
+
+    # close=False in a forked worker: drop the inherited pool without touching
+    # connections that belong to the parent process
+    engine.dispose(close=close)
+    for replica_engine in replica_engines:
+        replica_engine.dispose(close=close)
+    limiter.backend.dispose(close=close)
+
+
+class DrainingServer(uvicorn.Server):
+    def handle_exit(self, sig, frame):
+        # Readiness starts failing right away, uvicorn then stops accepting and drains in-flight requests
+        self.config.app.state.draining = True
+        super().handle_exit(sig, frame)
+
+
+def _run_worker(app, sock: socket.socket, args):
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+
+    _dispose_engines(close=False)
+
+    config = uvicorn.Config(
+        app,
+        log_level=args.log_level,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+    DrainingServer(config).run(sockets=[sock])
+
+
+def serve(args, pool_size: int):
+    # Pool sizes are read when app.database is imported, so set them before the preload
+    from . import config
+    config.DB_POOL_SIZE = pool_size
+    config.DB_MAX_OVERFLOW = 0
+
+    # Preload: startup DDL runs once here and workers inherit the imported app through fork
+    from .main import app
+
+    # No pooled connection may be shared across fork
+    _dispose_engines(close=True)
+
+    sock = socket.create_server((args.host, args.port), backlog=args.backlog)
+    sock.set_inheritable(True)
+
+    workers = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(app, sock, args)
+            finally:
+                os._exit(0)
+        workers.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(args.workers):
+        spawn()
+    print(f"Serving on {args.host}:{args.port} with {args.workers} workers, {pool_size} pooled connections each", flush=True)
+
+    kill_at = None
+    while workers:
+        pid, _ = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            if stopping:
+                kill_at = kill_at or time.monotonic() + args.graceful_timeout + KILL_GRACE_SECONDS
+                if time.monotonic() > kill_at:
+                    for straggler in workers:
+                        os.kill(straggler, signal.SIGKILL)
+            time.sleep(0.2)
+            continue
+
+        workers.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited, starting a replacement", flush=True)
+            time.sleep(RESPAWN_DELAY_SECONDS)
+            spawn()
+
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with preloaded, forked uvicorn workers.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--db-connections",
+        type=int,
+        default=int(os.getenv("DB_MAX_CONNECTIONS", "20")),
+        help="Connection budget shared by all workers (default: DB_MAX_CONNECTIONS or 20)",
+    )
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="Seconds to drain in-flight requests on shutdown")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > args.db_connections:
+        parser.error(f"--workers ({args.workers}) can't exceed --db-connections ({args.db_connections})")
+    try:
+        pool_size = worker_pool_size(args.db_connections, args.workers, reserved_connections())
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    serve(args, pool_size)
+
+
+if __name__ == "__main__":
+    main()
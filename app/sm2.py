@@ -1,9 +1,18 @@
 from datetime import datetime, timedelta
+import random
+
+from sqlalchemy import Float, Integer, case, cast, func, literal
 
 
 SM2_MIN_EASE = 1.3
 FIRST_INTERVAL_MINUTES = 10
 
+# Load balancing fuzz: intervals of at least FUZZ_MIN_INTERVAL days may move by
+# FUZZ_FRACTION of the interval either way, at least 1 and at most FUZZ_MAX_DAYS days
+FUZZ_MIN_INTERVAL = 3
+FUZZ_FRACTION = 0.05
+FUZZ_MAX_DAYS = 4
+
 
 def sm2_update(
     repetition_before: int,
@@ -11,6 +20,7 @@ def sm2_update(
     ease_before: float,
     quality: int,
     reviewed_at: datetime,
+    fuzz_days: int = 0,
 ) -> dict:
     
     # Should already be enforced via schema, but check to be sure
@@ -47,6 +57,9 @@ def sm2_update(
         elif repetition == 2: interval = 6
         else: interval = round(interval * ease)
 
+        # Load balancing shifts the interval itself, later intervals grow from the shifted one
+        interval += fuzz_days
+
         # Update interval normally
         next_review_at = reviewed_at + timedelta(days=interval)   
         repetition += 1
@@ -56,4 +69,65 @@ def sm2_update(
         "interval_days": interval,
         "ease_factor": ease,
         "next_review_at": next_review_at,
-    }
\ No newline at end of file
+    }
+
+def fuzz_spread(interval: int) -> int:
+    # Days the due date may move either way, 0 for short intervals
+    if interval < FUZZ_MIN_INTERVAL:
+        return 0
+    return min(FUZZ_MAX_DAYS, max(1, round(interval * FUZZ_FRACTION)))
+
+
+def choose_fuzz(card_id: int, repetition_before: int, interval: int, due_counts: dict[int, int]) -> int:
+    # due_counts maps day offsets from the unfuzzed due day to cards already due that day.
+    # The lightest day in the window wins, ties are broken by an rng seeded per card and
+    # repetition so cards learned together still drift apart.
+    spread = fuzz_spread(interval)
+    if not spread:
+        return 0
+
+    offsets = range(-spread, spread + 1)
+    lightest = min(due_counts.get(offset, 0) for offset in offsets)
+    candidates = [offset for offset in offsets if due_counts.get(offset, 0) == lightest]
+    return random.Random(f"{card_id}:{repetition_before}").choice(candidates)
+
+
+def sm2_update_sql(repetition_before, interval_before, ease_before, quality, reviewed_at) -> dict:
+
+    # Same maths as sm2_update as SQL expressions, for updates done inside the database.
+    # Every constant is cast to double precision (Postgres would otherwise use numeric) and
+    # the operations keep sm2_update's order, so the float results are bit-for-bit identical.
+    def f(value: float):
+        return cast(literal(value), Float)
+
+    q = quality
+
+    ease = ease_before + (f(0.1) - cast(5 - q, Float) * (f(0.08) + cast(5 - q, Float) * f(0.02)))
+    ease = func.greatest(ease, f(SM2_MIN_EASE))
+
+    # Python's round() on a float and Postgres' round(double precision) both round half to even
+    regular_interval = case(
+        (repetition_before == 1, literal(1, Integer)),
+        (repetition_before == 2, literal(6, Integer)),
+        else_=cast(func.round(cast(interval_before, Float) * ease), Integer),
+    )
+
+    failed = q < 3
+    learning = repetition_before == 0
+
+    repetition = case((failed, literal(0, Integer)), else_=repetition_before + 1)
+    interval = case((failed, literal(0, Integer)), (learning, literal(0, Integer)), else_=regular_interval)
+
+    # Whole seconds rather than days so no DST adjustment happens, matching timedelta arithmetic
+    next_review_at = case(
+        (failed, reviewed_at + func.make_interval(0, 0, 0, 0, 0, FIRST_INTERVAL_MINUTES)),
+        (learning, reviewed_at + func.make_interval(0, 0, 0, 0, 0, FIRST_INTERVAL_MINUTES)),
+        else_=reviewed_at + func.make_interval(0, 0, 0, 0, 0, 0, cast(regular_interval * 86400, Float)),
+    )
+
+    return {
+        "repetition_count": repetition,
+        "interval_days": interval,
+        "ease_factor": ease,
+        "next_review_at": next_review_at,
+    }
@@ -0,0 +1,120 @@
+import argparse
+from datetime import date
+
+from sqlalchemy import func, select, cast, Integer
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .dialects import upsert_insert, utc_date
+from .models import Deck, Card, CardSchedule, ReviewHistory, DailyReviewStats
+
+
+def utc_day(timestamp):
+    # Calendar day of a timestamp in UTC, rollups are keyed by UTC day
+    return utc_date(timestamp)
+
+
+def bump_daily_stats(db: Session, user_id: int, deck_id: int, day, reviews: int = 0, failures: int = 0, new_cards: int = 0):
+    stmt = upsert_insert(db, DailyReviewStats).values(
+        user_id=user_id,
+        deck_id=deck_id,
+        day=day,
+        reviews=reviews,
+        failures=failures,
+        new_cards=new_cards,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DailyReviewStats.user_id, DailyReviewStats.deck_id, DailyReviewStats.day],
+        set_={
+            "reviews": DailyReviewStats.reviews + stmt.excluded.reviews,
+            "failures": DailyReviewStats.failures + stmt.excluded.failures,
+            "new_cards": DailyReviewStats.new_cards + stmt.excluded.new_cards,
+        },
+    )
+    db.execute(stmt)
+
+
+def daily_stats(db: Session, user_id: int, start: date, end: date, deck_id: int | None = None) -> list:
+    stmt = (
+        select(
+            DailyReviewStats.day,
+            cast(func.sum(DailyReviewStats.reviews), Integer).label("reviews"),
+            cast(func.sum(DailyReviewStats.failures), Integer).label("failures"),
+            cast(func.sum(DailyReviewStats.new_cards), Integer).label("new_cards"),
+        )
+        .where(DailyReviewStats.user_id == user_id, DailyReviewStats.day.between(start, end))
+        .group_by(DailyReviewStats.day)
+        .order_by(DailyReviewStats.day.asc())
+    )
+    if deck_id is not None:
+        stmt = stmt.where(DailyReviewStats.deck_id == deck_id)
+    return db.execute(stmt).all()
+
+
+def backfill(bind: Engine):
+    # Recount from history, overwriting any existing rollups so reruns are idempotent
+    reviews_day = utc_day(ReviewHistory.reviewed_at)
+    reviews = (
+        select(
+            Deck.user_id,
+            Card.deck_id,
+            reviews_day.label("day"),
+            func.count().label("reviews"),
+            func.count().filter(ReviewHistory.quality < 3).label("failures"),
+            func.cast(0, Integer).label("new_cards"),
+        )
+        .join(Card, ReviewHistory.card_id == Card.id)
+        .join(Deck, Card.deck_id == Deck.id)
+        .group_by(Deck.user_id, Card.deck_id, reviews_day)
+    )
+    reviews_stmt = upsert_insert(bind, DailyReviewStats).from_select(
+        ["user_id", "deck_id", "day", "reviews", "failures", "new_cards"], reviews
+    )
+    reviews_stmt = reviews_stmt.on_conflict_do_update(
+        index_elements=[DailyReviewStats.user_id, DailyReviewStats.deck_id, DailyReviewStats.day],
+        set_={"reviews": reviews_stmt.excluded.reviews, "failures": reviews_stmt.excluded.failures},
+    )
+
+    # A card is learned when its schedule is created, schedules copied by a carry clone
+    # were learned in the source deck and never bumped new_cards
+    learned_day = utc_day(CardSchedule.created_at)
+    learned = (
+        select(
+            Deck.user_id,
+            CardSchedule.deck_id,
+            learned_day.label("day"),
+            func.cast(0, Integer).label("reviews"),
+            func.cast(0, Integer).label("failures"),
+            func.count().label("new_cards"),
+        )
+        .join(Deck, CardSchedule.deck_id == Deck.id)
+        .where(CardSchedule.is_carried == False)
+        .group_by(Deck.user_id, CardSchedule.deck_id, learned_day)
+    )
+    learned_stmt = upsert_insert(bind, DailyReviewStats).from_select(
+        ["user_id", "deck_id", "day", "reviews", "failures", "new_cards"], learned
+    )
+    learned_stmt = learned_stmt.on_conflict_do_update(
+        index_elements=[DailyReviewStats.user_id, DailyReviewStats.deck_id, DailyReviewStats.day],
+        set_={"new_cards": learned_stmt.excluded.new_cards},
+    )
+
+    with bind.begin() as conn:
+        conn.execute(reviews_stmt)
+        conn.execute(learned_stmt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain daily review rollups.")
+    parser.add_argument("--backfill", action="store_true", help="Rebuild rollups from existing review history")
+    args = parser.parse_args()
+
+    from .database import engine
+
+    if args.backfill:
+        backfill(engine)
+        print("Backfilled daily review stats")
+
+
+if __name__ == "__main__":
+    main()
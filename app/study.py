@@ -0,0 +1,231 @@
+from collections import deque
+from datetime import timedelta
+from typing import Callable
+import uuid
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, update, or_
+from sqlalchemy.orm import Session
+
+from .dialects import dialect_name, utcnow
+from .models import Deck, Card, CardSchedule
+from .stats import bump_daily_stats, utc_day
+from .changelog import record_change, ENTITY_CARD, ENTITY_SCHEDULE, OP_UPSERT
+
+
+# Cards kept ready per socket, topped up once fewer than STUDY_REFILL_AT are left
+STUDY_PREFETCH = 10
+STUDY_REFILL_AT = 3
+
+# Lease on prefetched due cards so other devices skip them, renewed by every refill
+STUDY_LEASE_SECONDS = 300
+
+
+# --- Lease helpers ---
+
+def lease_available(device_id: str | None):
+    # Schedule is unleased, its lease ran out, or the lease belongs to this device
+    return or_(
+        CardSchedule.lease_expires_at.is_(None),
+        CardSchedule.lease_expires_at <= utcnow(),
+        CardSchedule.lease_owner == device_id,
+    )
+
+
+# --- Claim and learn, shared by the card routes and study sockets ---
+
+def claim_due(db: Session, user_id: int, deck_id: int, count: int, lease_seconds: int, device_id: str) -> list:
+    # Confirm deck exists and belongs to user
+    deck_exists = (
+        db.query(Deck.id)
+        .filter(Deck.id == deck_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
+        .first()
+    )
+    if not deck_exists:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deck not found",
+        )
+
+    # Earliest due schedules that no other device holds
+    claimable = (
+        select(CardSchedule.card_id)
+        .where(CardSchedule.deck_id == deck_id, CardSchedule.next_review_at <= utcnow())
+        .where(lease_available(device_id))
+        .order_by(CardSchedule.next_review_at.asc())
+        .limit(count)
+    )
+    lease = {"lease_owner": device_id, "lease_expires_at": utcnow(timedelta(seconds=lease_seconds))}
+
+    if dialect_name(db) == "sqlite":
+        # No DML in CTEs on SQLite. The request already holds the write lock, so
+        # select, stamp and read back as separate statements.
+        card_ids = db.execute(claimable).scalars().all()
+        db.execute(update(CardSchedule).where(CardSchedule.card_id.in_(card_ids)).values(**lease))
+        cards = db.execute(
+            select(Card.id, Card.front, Card.back)
+            .join(CardSchedule, CardSchedule.card_id == Card.id)
+            .where(Card.id.in_(card_ids))
+            .order_by(CardSchedule.next_review_at.asc(), Card.id.asc())
+        ).all()
+    else:
+        # SKIP LOCKED means a concurrent claim moves on to the next rows instead of waiting on these
+        claimable = claimable.with_for_update(skip_locked=True).cte("claimable")
+
+        # Stamp the lease on exactly the locked rows
+        claimed = (
+            update(CardSchedule)
+            .where(CardSchedule.card_id == claimable.c.card_id)
+            .values(**lease)
+            .returning(CardSchedule.card_id, CardSchedule.next_review_at)
+            .cte("claimed")
+        )
+
+        cards = db.execute(
+            select(Card.id, Card.front, Card.back)
+            .join(claimed, claimed.c.card_id == Card.id)
+            .order_by(claimed.c.next_review_at.asc(), Card.id.asc())
+        ).all()
+
+    db.commit()
+    return cards
+
+
+def learn(db: Session, user_id: int, card_id: int):
+    # Fetch card + enforce ownership via deck. Lock card to prevent race
+    # condition where two requests may pass the is_learned check, and both
+    # try to create the schedule.
+    card = (
+        db.query(Card)
+        .join(Deck, Card.deck_id == Deck.id)
+        .filter(Card.id == card_id, Deck.user_id == user_id, Deck.deleted_at.is_(None))
+        .with_for_update()
+        .first()
+    )
+    if not card:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Card not found",
+        )
+
+    # Reject if already learned
+    if card.is_learned:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Card is already learned",
+        )
+
+    # Create initial schedule (due immediately)
+    schedule = CardSchedule(
+        card_id=card.id,
+        deck_id=card.deck_id,
+        repetition_count=0,
+        interval_days=0,
+        ease_factor=2.5,
+        next_review_at=utcnow(),
+        last_reviewed_at=None,
+    )
+
+    card.is_learned = True
+    db.add(schedule)
+
+    bump_daily_stats(db, user_id, card.deck_id, utc_day(utcnow()), new_cards=1)
+    record_change(db, user_id, ENTITY_CARD, card.id, OP_UPSERT, card.deck_id)
+    record_change(db, user_id, ENTITY_SCHEDULE, card.id, OP_UPSERT, card.deck_id)
+    db.commit()
+
+
+# --- Study sessions ---
+
+class StudySession:
+    # One WebSocket's queue of cards. review is main's submit_review, which owns the
+    # history buffer: review(db, user_id, card_id, quality) -> review result.
+    def __init__(self, db: Session, user_id: int, deck_id: int, new_limit: int, review: Callable[[Session, int, int, int], dict]):
+        self.db = db
+        self.user_id = user_id
+        self.deck_id = deck_id
+        self.device_id = f"ws:{uuid.uuid4().hex}"
+        self.new_limit = new_limit
+        self.new_learned = 0
+        self.review = review
+        self.queue: deque[dict] = deque()
+        self.current: dict | None = None
+
+    def refill(self):
+        if len(self.queue) >= STUDY_REFILL_AT:
+            return
+        # The card on screen counts as held until it is graded
+        held = [*self.queue, *([self.current] if self.current else [])]
+        queued = {entry["card"]["id"] for entry in held}
+
+        # Due cards first, claimed like any device's so other devices skip them.
+        # Cards already queued come back with their lease extended.
+        due = claim_due(
+            self.db,
+            user_id=self.user_id,
+            deck_id=self.deck_id,
+            count=STUDY_PREFETCH,
+            lease_seconds=STUDY_LEASE_SECONDS,
+            device_id=self.device_id,
+        )
+        for card in due:
+            if card.id not in queued and len(self.queue) < STUDY_PREFETCH:
+                self.queue.append({"kind": "due", "card": {"id": card.id, "front": card.front, "back": card.back}})
+                queued.add(card.id)
+
+        # Then new cards, up to the session's new card limit
+        pending_new = sum(entry["kind"] == "new" for entry in held)
+        count = min(STUDY_PREFETCH - len(self.queue), self.new_limit - self.new_learned - pending_new)
+        if count > 0:
+            new_cards = self.db.execute(
+                select(Card.id, Card.front, Card.back)
+                .where(Card.deck_id == self.deck_id, Card.is_learned == False, Card.id.not_in(queued))
+                .order_by(Card.id.asc())
+                .limit(count)
+            ).all()
+            self.db.commit()
+            for card in new_cards:
+                self.queue.append({"kind": "new", "card": {"id": card.id, "front": card.front, "back": card.back}})
+
+    def next_card(self) -> dict:
+        if not self.queue:
+            self.refill()
+        self.current = self.queue.popleft() if self.queue else None
+        if self.current is None:
+            return {"type": "done"}
+        return {"type": "card", **self.current}
+
+    def grade(self, card_id: int, quality: int) -> dict:
+        if self.current is None or self.current["card"]["id"] != card_id:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Not the current card",
+            )
+
+        # The card is used up either way, a failed review moves on to the next one
+        entry, self.current = self.current, None
+        try:
+            if entry["kind"] == "new":
+                learn(self.db, user_id=self.user_id, card_id=card_id)
+                self.new_learned += 1
+            result = self.review(self.db, self.user_id, card_id, quality)
+        except HTTPException:
+            self.db.rollback()
+            raise
+
+        return {
+            "type": "reviewed",
+            "card_id": card_id,
+            "interval_days": result["interval_days"],
+            "next_review_at": result["next_review_at"].isoformat(),
+        }
+
+    def close(self):
+        # Hand unreviewed cards back to other devices right away
+        self.db.rollback()
+        self.db.execute(
+            update(CardSchedule)
+            .where(CardSchedule.deck_id == self.deck_id, CardSchedule.lease_owner == self.device_id)
+            .values(lease_owner=None, lease_expires_at=None)
+        )
+        self.db.commit()
@@ -0,0 +1,86 @@
+import argparse
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateColumn, CreateIndex
+
+from .database import Base
+from .search import SEARCH_DDL, TRIGRAM_DDL
+
+
+# Index names TRIGRAM_DDL creates, checked before rerunning it
+TRIGRAM_INDEXES = {"ix_cards_front_trgm", "ix_cards_back_trgm"}
+
+
+def upgrade_schema(bind: Engine) -> list[str]:
+    # create_all only creates missing tables, bring tables created by older
+    # versions up to the current models. Safe to rerun, returns the DDL it ran.
+    if bind.dialect.name != "postgresql":
+        raise ValueError("Only Postgres databases can be upgraded in place, recreate SQLite databases instead")
+
+    applied = []
+
+    with bind.begin() as conn:
+        Base.metadata.create_all(bind=conn)
+        inspector = inspect(conn)
+
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+
+            # Every NOT NULL column added since has a server default, existing rows get it
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=conn.dialect)}"
+                    conn.exec_driver_sql(ddl)
+                    applied.append(ddl)
+
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    ddl = str(CreateIndex(index).compile(dialect=conn.dialect))
+                    conn.exec_driver_sql(ddl)
+                    applied.append(ddl)
+
+        # Emails used to be unique across all accounts, which blocks signing up again
+        # after a soft delete. uq_users_email_active replaces it.
+        for constraint in inspector.get_unique_constraints("users"):
+            if constraint["column_names"] == ["email"]:
+                ddl = f"ALTER TABLE users DROP CONSTRAINT {constraint['name']}"
+                conn.exec_driver_sql(ddl)
+                applied.append(ddl)
+
+        # Search structures are created with the cards table, add them to older ones
+        card_columns = {column["name"] for column in inspector.get_columns("cards")}
+        card_indexes = {index["name"] for index in inspector.get_indexes("cards")}
+        if "search_vector" not in card_columns:
+            for ddl in SEARCH_DDL:
+                conn.exec_driver_sql(ddl)
+                applied.append(ddl)
+        trigram_available = conn.exec_driver_sql("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").first() is not None
+        if trigram_available and not TRIGRAM_INDEXES <= card_indexes:
+            for ddl in TRIGRAM_DDL:
+                if not any(name in ddl for name in card_indexes & TRIGRAM_INDEXES):
+                    conn.exec_driver_sql(ddl)
+                    applied.append(ddl)
+
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add the columns, indexes and constraints newer versions expect to an existing database.")
+    args = parser.parse_args()
+
+    from .database import engine
+
+    try:
+        applied = upgrade_schema(engine)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    for ddl in applied:
+        print(ddl)
+    print(f"Applied {len(applied)} schema changes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import time
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import create_engine, insert, delete
+from sqlalchemy.orm import sessionmaker
+
+from app import review
+from app.models import Base, User, Deck, Card, CardSchedule
+
+
+# Reviews/sec on a single connection for each review write path.
+# Run against a scratch database: python -m benchmarks.bench_review --url postgresql://...
+
+
+def seed(engine, cards: int) -> tuple[int, list[int]]:
+    with engine.begin() as conn:
+        user_id = conn.execute(
+            insert(User).values(email=f"bench-{time.time_ns()}@example.com", password_hash="x").returning(User.id)
+        ).scalar_one()
+        deck_id = conn.execute(insert(Deck).values(name="bench", user_id=user_id).returning(Deck.id)).scalar_one()
+        card_ids = conn.execute(
+            insert(Card).returning(Card.id),
+            [{"front": f"F{i}", "back": f"B{i}", "deck_id": deck_id, "is_learned": True} for i in range(cards)],
+        ).scalars().all()
+
+        # Everything due a day ago, mid-way through its repetitions
+        conn.execute(
+            insert(CardSchedule),
+            [
+                {
+                    "card_id": card_id,
+                    "deck_id": deck_id,
+                    "repetition_count": 3,
+                    "interval_days": 6,
+                    "ease_factor": 2.5,
+                    "next_review_at": datetime.now(UTC) - timedelta(days=1),
+                }
+                for card_id in card_ids
+            ],
+        )
+    return user_id, card_ids
+
+
+def run(engine, write_path: str, cards: int) -> float:
+    user_id, card_ids = seed(engine, cards)
+    review.REVIEW_WRITE_PATH = write_path
+    Session = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+    with Session() as db:
+        start = time.perf_counter()
+        for i, card_id in enumerate(card_ids):
+            review.apply_review(db, user_id, card_id, 3 + i % 3)
+            db.commit()
+        elapsed = time.perf_counter() - start
+
+    with engine.begin() as conn:
+        conn.execute(delete(User).where(User.id == user_id))
+    return cards / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark review writes per connection.")
+    parser.add_argument("--url", required=True, help="Scratch database url, tables are created if missing")
+    parser.add_argument("--cards", type=int, default=2000)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url, pool_size=1, max_overflow=0)
+    Base.metadata.create_all(bind=engine)
+
+    # Warm up connections and plans before measuring
+    run(engine, "cte", 100)
+    run(engine, "orm", 100)
+
+    for write_path in ("orm", "cte"):
+        print(f"{write_path}: {run(engine, write_path, args.cards):.0f} reviews/sec")
+
+
+if __name__ == "__main__":
+    main()
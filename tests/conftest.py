@@ -1,20 +1,34 @@
 from app.config import TEST_DATABASE_URL
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
-from app.main import app
-from app.database import Base, get_db
+from app.main import app, limiter
+from app.database import Base, create_db_engine, get_db, get_write_db
+from app.security import pwd_context
 
-assert TEST_DATABASE_URL is not None, "TEST_DATABASE_URL not set, check if in dev environment."
-engine = create_engine(TEST_DATABASE_URL)
+# Without a Postgres test database the suite runs against in-memory SQLite
+engine = create_db_engine(TEST_DATABASE_URL or "sqlite://")
 TestingSessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
     bind=engine,
 )
 
+# Cheapest bcrypt cost, hashing at the production cost would dominate the suite's runtime
+pwd_context.update(bcrypt__rounds=4)
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "postgres: needs TEST_DATABASE_URL pointing at Postgres")
+
+def pytest_collection_modifyitems(config, items):
+    if engine.dialect.name == "postgresql":
+        return
+    skip_postgres = pytest.mark.skip(reason="needs TEST_DATABASE_URL pointing at Postgres")
+    for item in items:
+        if "postgres" in item.keywords:
+            item.add_marker(skip_postgres)
+
 @pytest.fixture(scope="session")
 def db():
     Base.metadata.drop_all(bind=engine)
@@ -23,13 +37,38 @@ def db():
     Base.metadata.drop_all(bind=engine)
 
 @pytest.fixture()
-def client(db):
+def connection(db):
+    # Each test runs inside one transaction that is rolled back afterwards,
+    # commits made by requests only release savepoints within it
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        yield connection
+        transaction.rollback()
+
+def make_client(session_factory):
     def override_get_db():
-        db = TestingSessionLocal()
+        db = session_factory()
         try:
             yield db
         finally:
             db.close()
 
     app.dependency_overrides[get_db] = override_get_db
-    return TestClient(app)
\ No newline at end of file
+    app.dependency_overrides[get_write_db] = override_get_db
+
+    # Tests share one client address, rate limiting is exercised in its own tests
+    limiter.enabled = False
+    return TestClient(app)
+
+@pytest.fixture()
+def client(connection):
+    return make_client(lambda: Session(bind=connection, join_transaction_mode="create_savepoint", autoflush=False))
+
+@pytest.fixture()
+def committed_client(db):
+    # Real commits, for tests that read through other connections, threads or background tasks
+    return make_client(TestingSessionLocal)
+
+@pytest.fixture()
+def db_engine(db):
+    return engine
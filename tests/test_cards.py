@@ -1,3 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, UTC
+
+import pytest
+from sqlalchemy import insert
+
+from app.models import ReviewHistory
+
+
 def auth_headers(client, email="card@test.com"):
     client.post("/signup", json={
         "email": email,
@@ -192,4 +201,194 @@ def test_due_cards_empty_when_nothing_learned(client):
         headers=headers
     )
     assert due.status_code == 200
-    assert due.json() == []
\ No newline at end of file
+    assert due.json() == []
+
+def test_bulk_learn_takes_next_unlearned_cards(client):
+    headers, deck_id = setup_user_deck(client, "bulk-learn@test.com")
+
+    ids = [
+        client.post(
+            f"/decks/{deck_id}/cards",
+            json={"front": f"F{i}", "back": f"B{i}"},
+            headers=headers
+        ).json()["id"]
+        for i in range(3)
+    ]
+
+    first = client.post(f"/decks/{deck_id}/cards/learn?count=2", headers=headers)
+    assert first.status_code == 201
+    assert [c["id"] for c in first.json()] == ids[:2]
+
+    second = client.post(f"/decks/{deck_id}/cards/learn?count=2", headers=headers)
+    assert [c["id"] for c in second.json()] == ids[2:]
+
+    third = client.post(f"/decks/{deck_id}/cards/learn?count=2", headers=headers)
+    assert third.json() == []
+
+    # Every learned card got a schedule and can be reviewed
+    for card_id in ids:
+        review = client.post(f"/cards/{card_id}/review", json={"quality": 4}, headers=headers)
+        assert review.status_code == 200
+
+
+@pytest.mark.postgres
+def test_bulk_learn_concurrent_devices_never_double_learn(committed_client):
+    client = committed_client
+    headers, deck_id = setup_user_deck(client, "bulk-concurrent@test.com")
+
+    for i in range(40):
+        client.post(
+            f"/decks/{deck_id}/cards",
+            json={"front": f"F{i}", "back": f"B{i}"},
+            headers=headers
+        )
+
+    def learn_batch(_):
+        return client.post(f"/decks/{deck_id}/cards/learn?count=10", headers=headers).json()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        batches = list(pool.map(learn_batch, range(4)))
+
+    learned = [c["id"] for batch in batches for c in batch]
+    assert len(learned) == 40
+    assert len(set(learned)) == 40
+
+    leftover = client.post(f"/decks/{deck_id}/cards/learn?count=10", headers=headers)
+    assert leftover.json() == []
+
+
+def test_claimed_due_cards_are_disjoint_per_device(client):
+    headers, deck_id = setup_user_deck(client, "lease@test.com")
+
+    for i in range(4):
+        client.post(
+            f"/decks/{deck_id}/cards",
+            json={"front": f"F{i}", "back": f"B{i}"},
+            headers=headers
+        )
+    client.post(f"/decks/{deck_id}/cards/learn?count=4", headers=headers)
+
+    phone = {**headers, "X-Device-Id": "phone"}
+    tablet = {**headers, "X-Device-Id": "tablet"}
+
+    phone_cards = client.post(f"/decks/{deck_id}/cards/due/claim?count=2", headers=phone).json()
+    tablet_cards = client.post(f"/decks/{deck_id}/cards/due/claim?count=5", headers=tablet).json()
+
+    phone_ids = {c["id"] for c in phone_cards}
+    tablet_ids = {c["id"] for c in tablet_cards}
+    assert len(phone_ids) == 2
+    assert len(tablet_ids) == 2
+    assert phone_ids.isdisjoint(tablet_ids)
+
+    # Plain due fetches skip cards leased to the other device
+    due = client.get(f"/decks/{deck_id}/cards/due", headers=phone)
+    assert due.json()["id"] in phone_ids
+
+    # Reviewing releases the lease
+    for card_id in tablet_ids:
+        assert client.post(f"/cards/{card_id}/review", json={"quality": 1}, headers=tablet).status_code == 200
+
+
+def test_claim_requires_device_id(client):
+    headers, deck_id = setup_user_deck(client, "lease-header@test.com")
+
+    res = client.post(f"/decks/{deck_id}/cards/due/claim", headers=headers)
+    assert res.status_code == 422
+
+
+def test_search_ranks_prefix_matches(client):
+    headers, deck_id = setup_user_deck(client, "search@test.com")
+
+    for front, back in [("Photosynthesis", "Plants turn light into energy"), ("Mitochondria", "Powerhouse of the cell")]:
+        client.post(f"/decks/{deck_id}/cards", json={"front": front, "back": back}, headers=headers)
+
+    prefix = client.get("/cards/search?q=photo", headers=headers)
+    assert prefix.status_code == 200
+    assert [c["front"] for c in prefix.json()] == ["Photosynthesis"]
+
+    back = client.get(f"/cards/search?q=powerhouse&deck_id={deck_id}", headers=headers)
+    assert [c["front"] for c in back.json()] == ["Mitochondria"]
+
+
+def test_search_matches_words_after_punctuation_and_newlines(client):
+    headers, deck_id = setup_user_deck(client, "search-words@test.com")
+    client.post(f"/decks/{deck_id}/cards", json={"front": "hello (world)", "back": "first line\nSecond-line"}, headers=headers)
+
+    for q in ("world", "second", "line"):
+        assert [c["front"] for c in client.get(f"/cards/search?q={q}", headers=headers).json()] == ["hello (world)"]
+
+    # Still word starts only
+    assert client.get("/cards/search?q=orld", headers=headers).json() == []
+
+
+@pytest.mark.postgres
+def test_search_tolerates_typos(client, db_engine):
+    with db_engine.connect() as conn:
+        if conn.exec_driver_sql("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first() is None:
+            pytest.skip("pg_trgm is not installed")
+
+    headers, deck_id = setup_user_deck(client, "search-typo@test.com")
+    client.post(f"/decks/{deck_id}/cards", json={"front": "Mitochondria", "back": "Powerhouse"}, headers=headers)
+
+    typo = client.get("/cards/search?q=mitochondira", headers=headers)
+    assert [c["front"] for c in typo.json()] == ["Mitochondria"]
+
+
+def test_search_is_scoped_to_owner(client):
+    headers1, deck1 = setup_user_deck(client, "search-owner@test.com")
+    headers2, _ = setup_user_deck(client, "search-other@test.com")
+
+    client.post(f"/decks/{deck1}/cards", json={"front": "Secretword", "back": "Hidden"}, headers=headers1)
+
+    res = client.get("/cards/search?q=secretword", headers=headers2)
+    assert res.status_code == 200
+    assert res.json() == []
+
+
+def add_reviews(connection, card_id, count):
+    start = datetime(2026, 1, 1, tzinfo=UTC)
+    connection.execute(insert(ReviewHistory), [
+        {
+            "card_id": card_id, "reviewed_at": start + timedelta(days=i), "quality": i % 6,
+            "repetition_before": i, "interval_before": 1, "ease_before": 2.5,
+            "repetition_after": i + 1, "interval_after": 1, "ease_after": 2.5,
+            "next_review_at_after": start + timedelta(days=i + 1),
+        }
+        for i in range(count)
+    ])
+
+
+def test_card_history_pages_newest_first(client, connection):
+    headers, deck_id = setup_user_deck(client)
+    card_id = client.post(f"/decks/{deck_id}/cards", json={"front": "F", "back": "B"}, headers=headers).json()["id"]
+    add_reviews(connection, card_id, 5)
+
+    first = client.get(f"/cards/{card_id}/history?limit=3", headers=headers).json()
+    assert [r["repetition_before"] for r in first["reviews"]] == [4, 3, 2]
+    assert first["has_more"]
+
+    second = client.get(f"/cards/{card_id}/history?limit=3&before={first['cursor']}", headers=headers).json()
+    assert [r["repetition_before"] for r in second["reviews"]] == [1, 0]
+    assert not second["has_more"]
+
+    other_headers = auth_headers(client, "history-other@test.com")
+    assert client.get(f"/cards/{card_id}/history", headers=other_headers).status_code == 404
+
+
+def test_recent_history_for_several_cards(client, connection):
+    headers, deck_id = setup_user_deck(client)
+    card_ids = [
+        client.post(f"/decks/{deck_id}/cards", json={"front": f"F{i}", "back": "B"}, headers=headers).json()["id"]
+        for i in range(3)
+    ]
+    add_reviews(connection, card_ids[0], 4)
+    add_reviews(connection, card_ids[1], 1)
+
+    other_headers, other_deck_id = setup_user_deck(client, "recent-other@test.com")
+    foreign_id = client.post(f"/decks/{other_deck_id}/cards", json={"front": "F", "back": "B"}, headers=other_headers).json()["id"]
+    add_reviews(connection, foreign_id, 2)
+
+    res = client.get("/cards/history", params={"card_ids": [*card_ids, foreign_id], "per_card": 2}, headers=headers)
+    assert res.status_code == 200
+    history = {entry["card_id"]: [r["repetition_before"] for r in entry["reviews"]] for entry in res.json()}
+    assert history == {card_ids[0]: [3, 2], card_ids[1]: [0], card_ids[2]: []}
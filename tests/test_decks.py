@@ -1,3 +1,9 @@
+from sqlalchemy import select
+
+from app import purge
+from app.models import Deck, Card, CardSchedule
+
+
 def auth_headers(client, email="deck@test.com"):
     client.post("/signup", json={
         "email": email,
@@ -38,4 +44,135 @@ def test_deck_ownership(client):
     ).json()
 
     res = client.get(f"/decks/{deck['id']}", headers=user2)
-    assert res.status_code == 404
\ No newline at end of file
+    assert res.status_code == 404
+
+def create_cards(client, headers, deck_id, count):
+    return [
+        client.post(
+            f"/decks/{deck_id}/cards",
+            json={"front": f"F{i}", "back": f"B{i}"},
+            headers=headers
+        ).json()["id"]
+        for i in range(count)
+    ]
+
+
+def test_delete_deck_cascades_in_database(committed_client, db_engine):
+    client = committed_client
+    headers = auth_headers(client, "delete-small@test.com")
+    deck = client.post("/decks", json={"name": "Small"}, headers=headers).json()
+    card_ids = create_cards(client, headers, deck["id"], 2)
+    client.post(f"/cards/{card_ids[0]}/learn", headers=headers)
+
+    res = client.delete(f"/decks/{deck['id']}", headers=headers)
+    assert res.status_code == 204
+
+    with db_engine.connect() as conn:
+        remaining = conn.execute(select(Card.id).where(Card.id.in_(card_ids))).all()
+        schedules = conn.execute(select(CardSchedule.card_id).where(CardSchedule.card_id.in_(card_ids))).all()
+    assert remaining == []
+    assert schedules == []
+
+
+def test_delete_large_deck_is_soft_deleted_then_purged(committed_client, db_engine, monkeypatch):
+    client = committed_client
+    monkeypatch.setattr(purge, "SOFT_DELETE_CARD_THRESHOLD", 2)
+    monkeypatch.setattr(purge, "PURGE_CHUNK_SIZE", 2)
+
+    headers = auth_headers(client, "delete-large@test.com")
+    deck = client.post("/decks", json={"name": "Large"}, headers=headers).json()
+    card_ids = create_cards(client, headers, deck["id"], 5)
+
+    res = client.delete(f"/decks/{deck['id']}", headers=headers)
+    assert res.status_code == 204
+    assert client.get(f"/decks/{deck['id']}", headers=headers).status_code == 404
+
+    # TestClient runs background tasks before returning, so the purge has finished
+    with db_engine.connect() as conn:
+        assert conn.execute(select(Card.id).where(Card.id.in_(card_ids))).all() == []
+        assert conn.execute(select(Deck.id).where(Deck.id == deck["id"])).all() == []
+
+
+def test_delete_large_account_frees_email(committed_client, db_engine, monkeypatch):
+    client = committed_client
+    monkeypatch.setattr(purge, "SOFT_DELETE_CARD_THRESHOLD", 1)
+
+    headers = auth_headers(client, "delete-account@test.com")
+    deck = client.post("/decks", json={"name": "Mine"}, headers=headers).json()
+    create_cards(client, headers, deck["id"], 3)
+
+    res = client.request(
+        "DELETE",
+        "/users/me",
+        json={"password": "password123"},
+        headers=headers
+    )
+    assert res.status_code == 204
+
+    with db_engine.connect() as conn:
+        assert conn.execute(select(Deck.id).where(Deck.id == deck["id"])).all() == []
+
+    signup = client.post("/signup", json={
+        "email": "delete-account@test.com",
+        "password": "password123"
+    })
+    assert signup.status_code == 201
+
+
+def make_deck(client, headers, name, cards):
+    deck_id = client.post("/decks", json={"name": name}, headers=headers).json()["id"]
+    for front in cards:
+        client.post(f"/decks/{deck_id}/cards", json={"front": front, "back": "B"}, headers=headers)
+    return deck_id
+
+
+def test_clone_copies_cards_and_optionally_schedules(client):
+    headers = auth_headers(client, "clone@test.com")
+    deck_id = make_deck(client, headers, "Source", ["A", "B", "C"])
+    client.post(f"/decks/{deck_id}/cards/learn?count=2", headers=headers)
+
+    reset = client.post(f"/decks/{deck_id}/clone", headers=headers)
+    assert reset.status_code == 201
+    assert reset.json()["cards_copied"] == 3
+    reset_id = reset.json()["deck"]["id"]
+    assert reset.json()["deck"]["name"] == "Source"
+    assert [c["front"] for c in client.get(f"/decks/{reset_id}/cards", headers=headers).json()] == ["A", "B", "C"]
+    assert client.get(f"/decks/{reset_id}/cards/due", headers=headers).status_code == 404
+
+    carry = client.post(f"/decks/{deck_id}/clone", json={"name": "Copy", "schedule": "carry"}, headers=headers).json()
+    carry_id = carry["deck"]["id"]
+    assert client.get(f"/decks/{carry_id}/cards/due", headers=headers).json()["front"] in ("A", "B")
+    assert client.get(f"/decks/{carry_id}/cards/new", headers=headers).json()["front"] == "C"
+
+    # The clone reaches other devices through sync
+    synced = client.get("/sync", headers=headers).json()
+    assert {carry_id, reset_id} <= {d["id"] for d in synced["decks"]}
+    assert len([c for c in synced["cards"] if c["deck_id"] == carry_id]) == 3
+    assert len([s for s in synced["schedules"] if s["deck_id"] == carry_id]) == 2
+
+
+def test_templates_are_browsable_and_clonable_by_others(client):
+    owner = auth_headers(client, "template-owner@test.com")
+    other = auth_headers(client, "template-user@test.com")
+    deck_id = make_deck(client, owner, "Shared", ["One", "Two"])
+
+    # Private until published
+    assert client.post(f"/decks/{deck_id}/clone", headers=other).status_code == 404
+    assert client.post(f"/decks/{deck_id}/publish", headers=other).status_code == 404
+    assert client.post(f"/decks/{deck_id}/publish", headers=owner).json()["is_template"]
+
+    templates = client.get("/templates", headers=other).json()
+    assert {"id": deck_id, "name": "Shared", "card_count": 2} in templates
+    first, second = client.get(f"/templates/{deck_id}/cards", headers=other).json()
+    assert client.get(f"/templates/{deck_id}/cards?after={first['id']}", headers=other).json() == [second]
+
+    # Read-only for everyone but the owner
+    assert client.post(f"/decks/{deck_id}/cards", json={"front": "X", "back": "Y"}, headers=other).status_code == 404
+    assert client.post(f"/decks/{deck_id}/clone", json={"schedule": "carry"}, headers=other).status_code == 400
+
+    clone = client.post(f"/decks/{deck_id}/clone", headers=other).json()
+    assert clone["cards_copied"] == 2
+    assert not clone["deck"]["is_template"]
+
+    client.delete(f"/decks/{deck_id}/publish", headers=owner)
+    assert client.get(f"/templates/{deck_id}/cards", headers=other).status_code == 404
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import select, update
+
+from app import review
+from app.models import CardSchedule, ReviewHistory
+from app.rebuild import rebuild_schedules
+from app.sm2 import choose_fuzz, fuzz_spread
+
+
+def test_fuzz_is_bounded_and_prefers_lighter_days():
+    assert fuzz_spread(1) == 0
+    assert fuzz_spread(6) == 1
+    assert fuzz_spread(400) == 4
+
+    # Without load, the seeded pick is repeatable and inside the window
+    picks = [choose_fuzz(card_id, 3, 60, {}) for card_id in range(50)]
+    assert picks == [choose_fuzz(card_id, 3, 60, {}) for card_id in range(50)]
+    assert all(-3 <= pick <= 3 for pick in picks)
+    assert len(set(picks)) > 1
+
+    assert choose_fuzz(1, 3, 60, {-3: 4, -2: 4, -1: 4, 0: 9, 1: 4, 2: 1, 3: 4}) == 2
+
+
+def test_fuzz_is_recorded_and_replayed(committed_client, db_engine, monkeypatch):
+    monkeypatch.setattr(review, "SCHEDULE_FUZZ_ENABLED", True)
+    client = committed_client
+
+    client.post("/signup", json={"email": "fuzz@test.com", "password": "password123"})
+    token = client.post("/login", json={"email": "fuzz@test.com", "password": "password123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    deck_id = client.post("/decks", json={"name": "Fuzz"}, headers=headers).json()["id"]
+    for i in range(3):
+        client.post(f"/decks/{deck_id}/cards", json={"front": f"F{i}", "back": "B"}, headers=headers)
+    card_id, *others = [c["id"] for c in client.post(f"/decks/{deck_id}/cards/learn?count=3", headers=headers).json()]
+
+    # The third review lands on a 6 day interval. Load the 5th and 6th day so the 7th is lightest.
+    now = datetime.now(UTC)
+    with db_engine.begin() as conn:
+        for other, days in zip(others, (5, 6)):
+            conn.execute(update(CardSchedule).where(CardSchedule.card_id == other).values(next_review_at=now + timedelta(days=days, hours=1)))
+
+    for _ in range(3):
+        with db_engine.begin() as conn:
+            conn.execute(update(CardSchedule).where(CardSchedule.card_id == card_id).values(next_review_at=now - timedelta(minutes=1)))
+        assert client.post(f"/cards/{card_id}/review", json={"quality": 4}, headers=headers).status_code == 200
+
+    with db_engine.connect() as conn:
+        fuzz_days, interval = conn.execute(
+            select(ReviewHistory.fuzz_days, ReviewHistory.interval_after)
+            .where(ReviewHistory.card_id == card_id)
+            .order_by(ReviewHistory.id.desc())
+        ).first()
+    assert (fuzz_days, interval) == (1, 7)
+
+    report = rebuild_schedules(db_engine, deck_id=deck_id)
+    assert report["cards_replayed"] == 1
+    assert report["divergent"] == []
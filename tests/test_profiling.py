@@ -0,0 +1,38 @@
+import json
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from app.profiling import ProfilingMiddleware
+
+
+def test_selected_requests_write_stacks_and_sql(db_engine, tmp_path):
+    profiled = FastAPI()
+
+    @profiled.get("/slow")
+    def slow():
+        with db_engine.connect() as conn:
+            conn.execute(text("SELECT 1")).scalar()
+        time.sleep(0.1)
+        return {"ok": True}
+
+    profiled.add_middleware(ProfilingMiddleware, token="secret", sample_rate=0, directory=str(tmp_path))
+    client = TestClient(profiled)
+
+    # Not selected: no header, no sampling
+    assert "X-Profile-Id" not in client.get("/slow").headers
+    assert list(tmp_path.iterdir()) == []
+
+    res = client.get("/slow", headers={"X-Profile": "secret"})
+    profile_id = res.headers["X-Profile-Id"]
+
+    summary = json.loads(next(tmp_path.glob(f"*-{profile_id}.json")).read_text())
+    assert summary["status"] == 200
+    assert "SELECT 1" in [s["statement"] for s in summary["sql"]]
+
+    # The sleeping route thread was sampled, attributed to the request through its SQL
+    folded = next(tmp_path.glob(f"*-{profile_id}.folded")).read_text()
+    assert ":test_selected_requests_write_stacks_and_sql.<locals>.slow" in folded
+    assert summary["samples"] > 5
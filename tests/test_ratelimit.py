@@ -0,0 +1,96 @@
+import uuid
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app.main import limiter
+from app.ratelimit import MemoryBackend, DatabaseBackend
+
+
+@pytest.fixture()
+def limited(client, monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", True)
+    monkeypatch.setattr(limiter, "backend", MemoryBackend())
+    monkeypatch.setattr(limiter, "limits", {"auth": (2, 0.01), "auth_address": (4, 0.01), "review": (30, 5.0), "default": (60, 20.0)})
+    return client
+
+
+def test_login_is_rate_limited_per_address_and_email(limited):
+    for _ in range(2):
+        res = limited.post("/login", json={"email": "nobody@test.com", "password": "password123"})
+        assert res.status_code == 401
+
+    blocked = limited.post("/login", json={"email": "nobody@test.com", "password": "password123"})
+    assert blocked.status_code == 429
+    assert int(blocked.headers["Retry-After"]) >= 1
+
+    # Other users behind the same address (a proxy) keep their own bucket, and the body still reaches the route
+    other = limited.post("/login", json={"email": "Somebody@test.com", "password": "password123"})
+    assert other.status_code == 401
+
+    # Other route classes have their own buckets
+    assert limited.get("/health").status_code == 200
+
+
+def test_rotating_emails_still_hits_the_address_bucket(limited):
+    codes = [limited.post("/signup", json={"email": f"rotate{i}@test.com", "password": "password123"}).status_code for i in range(6)]
+    assert codes == [201] * 4 + [429] * 2
+
+
+def test_admission_control_sheds_load(limited, monkeypatch):
+    monkeypatch.setattr(limiter, "max_in_flight", 0)
+
+    res = limited.get("/health")
+    assert res.status_code == 503
+    assert "Retry-After" in res.headers
+
+
+def test_websocket_handshakes_are_admitted_and_rate_limited(limited, monkeypatch):
+    monkeypatch.setattr(limiter, "max_in_flight", 0)
+    with pytest.raises(WebSocketDisconnect) as busy:
+        with limited.websocket_connect("/ws/study/1"):
+            pass
+    assert busy.value.code == 1013
+
+    monkeypatch.setattr(limiter, "max_in_flight", 100)
+    monkeypatch.setattr(limiter, "limits", {**limiter.limits, "default": (1, 0.01)})
+    with pytest.raises(WebSocketDisconnect) as unauthenticated:
+        with limited.websocket_connect("/ws/study/1"):
+            pass
+    assert unauthenticated.value.code == 1008
+
+    with pytest.raises(WebSocketDisconnect) as limited_out:
+        with limited.websocket_connect("/ws/study/1"):
+            pass
+    assert (limited_out.value.code, limited_out.value.reason) == (1008, "Too many requests")
+
+
+def test_open_websockets_count_as_in_flight(limited):
+    limited.post("/signup", json={"email": "socket@test.com", "password": "password123"})
+    token = limited.post("/login", json={"email": "socket@test.com", "password": "password123"}).json()["access_token"]
+    deck_id = limited.post("/decks", json={"name": "Socket"}, headers={"Authorization": f"Bearer {token}"}).json()["id"]
+
+    with limited.websocket_connect(f"/ws/study/{deck_id}?token={token}") as ws:
+        assert ws.receive_json() == {"type": "done"}
+        assert limiter.in_flight == 1
+    assert limiter.in_flight == 0
+
+
+def test_database_backend_shares_buckets(db_engine):
+    first = DatabaseBackend(db_engine)
+    second = DatabaseBackend(db_engine)
+
+    # Two backends stand in for two workers sharing one database
+    key = f"shared:{uuid.uuid4()}"
+    assert first.take(key, 1, 0.01) == 0
+    assert second.take(key, 1, 0.01) > 0
+
+
+def test_database_backend_shares_marks(db_engine):
+    first = DatabaseBackend(db_engine)
+    second = DatabaseBackend(db_engine)
+
+    key = f"write:{uuid.uuid4()}"
+    assert second.marked_at(key) is None
+    first.mark(key)
+    assert second.marked_at(key) is not None
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update
+
+from app.models import CardSchedule, Deck
+from app.rebuild import SCHEDULE_FIELDS, _write_schedules, rebuild_schedules
+
+
+def setup_reviewed_card(client, email="rebuild@test.com"):
+    client.post("/signup", json={"email": email, "password": "password123"})
+    token = client.post("/login", json={"email": email, "password": "password123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    deck_id = client.post("/decks", json={"name": "Rebuild"}, headers=headers).json()["id"]
+    card = client.post(
+        f"/decks/{deck_id}/cards",
+        json={"front": "Replay", "back": "Me"},
+        headers=headers
+    ).json()
+
+    client.post(f"/cards/{card['id']}/learn", headers=headers)
+    review = client.post(f"/cards/{card['id']}/review", json={"quality": 4}, headers=headers)
+    assert review.status_code == 200
+
+    return deck_id, card["id"]
+
+
+def test_rebuild_matches_live_schedule(committed_client, db_engine):
+    deck_id, _ = setup_reviewed_card(committed_client)
+
+    report = rebuild_schedules(db_engine, deck_id=deck_id)
+    assert report["cards_replayed"] == 1
+    assert report["divergent"] == []
+    assert report["cards_updated"] == 0
+
+
+def test_rebuild_flags_and_repairs_divergent_schedule(committed_client, db_engine):
+    deck_id, card_id = setup_reviewed_card(committed_client, "rebuild-diverge@test.com")
+
+    with db_engine.begin() as conn:
+        conn.execute(update(CardSchedule).where(CardSchedule.card_id == card_id).values(ease_factor=1.3))
+
+    dry = rebuild_schedules(db_engine, deck_id=deck_id, dry_run=True)
+    assert [d["card_id"] for d in dry["divergent"]] == [card_id]
+    assert "ease_factor" in dry["divergent"][0]["fields"]
+    assert dry["cards_updated"] == 0
+
+    applied = rebuild_schedules(db_engine, deck_id=deck_id)
+    assert applied["cards_updated"] == 1
+
+    again = rebuild_schedules(db_engine, deck_id=deck_id)
+    assert again["divergent"] == []
+
+
+def test_rebuild_repairs_reach_sync_clients(committed_client, db_engine):
+    deck_id, card_id = setup_reviewed_card(committed_client, "rebuild-sync@test.com")
+    token = committed_client.post("/login", json={"email": "rebuild-sync@test.com", "password": "password123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    with db_engine.begin() as conn:
+        conn.execute(update(CardSchedule).where(CardSchedule.card_id == card_id).values(ease_factor=1.3))
+    cursor = committed_client.get("/sync?since=0", headers=headers).json()["cursor"]
+
+    assert rebuild_schedules(db_engine, deck_id=deck_id)["cards_updated"] == 1
+
+    delta = committed_client.get(f"/sync?since={cursor}", headers=headers).json()
+    assert [s["card_id"] for s in delta["schedules"]] == [card_id]
+    assert delta["schedules"][0]["ease_factor"] != 1.3
+
+
+def test_rebuild_keeps_schedules_carried_over_by_clone(committed_client, db_engine):
+    deck_id, card_id = setup_reviewed_card(committed_client, "rebuild-clone@test.com")
+    token = committed_client.post("/login", json={"email": "rebuild-clone@test.com", "password": "password123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # A mature, due schedule, far from the learn_card state a replay used to start from
+    with db_engine.begin() as conn:
+        conn.execute(
+            update(CardSchedule)
+            .where(CardSchedule.card_id == card_id)
+            .values(repetition_count=5, interval_days=51, ease_factor=3.0, next_review_at=datetime.now(timezone.utc) - timedelta(minutes=1))
+        )
+
+    clone_id = committed_client.post(f"/decks/{deck_id}/clone", json={"schedule": "carry"}, headers=headers).json()["deck"]["id"]
+    cloned_card_id = committed_client.get(f"/decks/{clone_id}/cards", headers=headers).json()[0]["id"]
+    assert committed_client.post(f"/cards/{cloned_card_id}/review", json={"quality": 4}, headers=headers).status_code == 200
+
+    report = rebuild_schedules(db_engine, deck_id=clone_id)
+    assert report["cards_replayed"] == 1
+    assert report["divergent"] == []
+
+
+def test_rebuild_skips_schedules_ahead_of_their_history(committed_client, db_engine):
+    deck_id, card_id = setup_reviewed_card(committed_client, "rebuild-buffered@test.com")
+
+    # A second review whose history row is still in the write-behind buffer
+    reviewed_at = datetime.now(timezone.utc) + timedelta(minutes=1)
+    with db_engine.begin() as conn:
+        conn.execute(
+            update(CardSchedule)
+            .where(CardSchedule.card_id == card_id)
+            .values(repetition_count=2, interval_days=6, ease_factor=2.6, last_reviewed_at=reviewed_at)
+        )
+
+    report = rebuild_schedules(db_engine, deck_id=deck_id)
+    assert report["pending_history"] == [card_id]
+    assert report["cards_updated"] == 0
+
+    with db_engine.connect() as conn:
+        schedule = conn.execute(select(CardSchedule).where(CardSchedule.card_id == card_id)).one()
+    assert schedule.repetition_count == 2
+    assert schedule.last_reviewed_at == reviewed_at
+
+
+def test_rebuild_write_skips_schedule_reviewed_since_the_read(committed_client, db_engine):
+    deck_id, card_id = setup_reviewed_card(committed_client, "rebuild-race@test.com")
+
+    with db_engine.connect() as conn:
+        read = conn.execute(select(CardSchedule, Deck.user_id).join(Deck).where(CardSchedule.card_id == card_id)).one()
+
+    # Reviewed again between the stream's read and the batch write
+    with db_engine.begin() as conn:
+        conn.execute(
+            update(CardSchedule)
+            .where(CardSchedule.card_id == card_id)
+            .values(last_reviewed_at=read.last_reviewed_at + timedelta(minutes=1))
+        )
+
+    row = {name: getattr(read, name) for name in SCHEDULE_FIELDS}
+    row.update(card_id=card_id, ease_factor=1.3, stored_last_reviewed_at=read.last_reviewed_at, user_id=read.user_id, deck_id=deck_id)
+    assert _write_schedules(db_engine, [row]) == 0
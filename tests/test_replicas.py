@@ -0,0 +1,110 @@
+from app.config import TEST_REPLICA_DATABASE_URL
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.main as app_main
+from app.main import app
+from app.database import Base, ReplicaRouter, get_db
+from app.ratelimit import MemoryBackend
+
+from conftest import TestingSessionLocal
+
+
+def auth_headers(client, email):
+    client.post("/signup", json={
+        "email": email,
+        "password": "password123"
+    })
+    login = client.post("/login", json={
+        "email": email,
+        "password": "password123"
+    })
+    token = login.json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture()
+def replica(committed_client):
+    if TEST_REPLICA_DATABASE_URL is None:
+        pytest.skip("TEST_REPLICA_DATABASE_URL not set")
+
+    # A second, independent Postgres instance stands in for the replica. Nothing is
+    # replicated to it, so whichever database served a read is visible in the result.
+    replica_engine = create_engine(TEST_REPLICA_DATABASE_URL)
+    Base.metadata.drop_all(bind=replica_engine)
+    Base.metadata.create_all(bind=replica_engine)
+    yield sessionmaker(bind=replica_engine, autocommit=False, autoflush=False)
+    Base.metadata.drop_all(bind=replica_engine)
+    replica_engine.dispose()
+
+
+@pytest.fixture()
+def replica_router(replica):
+    router = ReplicaRouter(TestingSessionLocal, [replica], sticky_seconds=60)
+    app.dependency_overrides[get_db] = router.get_db
+    return router
+
+
+def test_reads_stick_to_primary_after_write_then_use_replica(committed_client, replica_router):
+    client = committed_client
+    headers = auth_headers(client, "replica@test.com")
+    client.post("/decks", json={"name": "Fresh"}, headers=headers)
+
+    # Inside the stickiness window the read sees the user's own write
+    sticky = client.get("/decks", headers=headers)
+    assert [d["name"] for d in sticky.json()] == ["Fresh"]
+
+    # Once the window has passed, reads are routed to the replica
+    replica_router.sticky_seconds = 0
+    routed = client.get("/decks", headers=headers)
+    assert routed.status_code == 200
+    assert routed.json() == []
+
+
+def test_read_after_write_sticks_on_another_worker(committed_client, replica):
+    client = committed_client
+    headers = auth_headers(client, "replica-workers@test.com")
+
+    # Each serve worker has its own router, nothing is shared between them
+    writer = ReplicaRouter(TestingSessionLocal, [replica], sticky_seconds=60)
+    reader = ReplicaRouter(TestingSessionLocal, [replica], sticky_seconds=60)
+
+    app.dependency_overrides[get_db] = writer.get_db
+    client.post("/decks", json={"name": "Fresh"}, headers=headers)
+
+    app.dependency_overrides[get_db] = reader.get_db
+    assert [d["name"] for d in client.get("/decks", headers=headers).json()] == ["Fresh"]
+
+    # A client without the write's cookie is served by the replica
+    client.cookies.clear()
+    assert client.get("/decks", headers=headers).json() == []
+
+
+def test_reads_stick_by_user_without_the_cookie(committed_client, replica, monkeypatch):
+    client = committed_client
+    headers = auth_headers(client, "replica-marks@test.com")
+    token = headers["Authorization"][7:]
+
+    # The study socket marks writes on the app's router, the test router stands in for it
+    router = ReplicaRouter(TestingSessionLocal, [replica], sticky_seconds=60, marks=MemoryBackend())
+    monkeypatch.setattr(app_main, "router", router)
+    app.dependency_overrides[get_db] = router.get_db
+
+    # A bearer-token client that drops the cookie still reads its own write
+    deck_id = client.post("/decks", json={"name": "Fresh"}, headers=headers).json()["id"]
+    card_id = client.post(f"/decks/{deck_id}/cards", json={"front": "Q", "back": "A"}, headers=headers).json()["id"]
+    client.post(f"/cards/{card_id}/learn", headers=headers)
+    client.cookies.clear()
+    assert [d["name"] for d in client.get("/decks", headers=headers).json()] == ["Fresh"]
+
+    # Without a recent write the reads go to the replica
+    router.marks = MemoryBackend()
+    assert client.get("/decks", headers=headers).json() == []
+
+    # A grade over the study socket sets no cookie, the user's reads still stick
+    with client.websocket_connect(f"/ws/study/{deck_id}?token={token}") as ws:
+        assert ws.receive_json()["card"]["id"] == card_id
+        ws.send_json({"card_id": card_id, "quality": 4})
+        assert ws.receive_json()["type"] == "reviewed"
+    assert [d["name"] for d in client.get("/decks", headers=headers).json()] == ["Fresh"]
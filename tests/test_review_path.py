@@ -0,0 +1,130 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import itertools
+
+import pytest
+from sqlalchemy import select, literal, DateTime, Integer
+
+from app import main, review, history_buffer
+from app.history_buffer import HistoryBuffer, HistoryWriteError
+from app.models import ReviewHistory
+from app.sm2 import sm2_update, sm2_update_sql
+
+
+def setup_learned_card(client, email):
+    client.post("/signup", json={"email": email, "password": "password123"})
+    token = client.post("/login", json={"email": email, "password": "password123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    deck_id = client.post("/decks", json={"name": "Review"}, headers=headers).json()["id"]
+    card = client.post(f"/decks/{deck_id}/cards", json={"front": "Q", "back": "A"}, headers=headers).json()
+    client.post(f"/cards/{card['id']}/learn", headers=headers)
+    return headers, card["id"]
+
+
+@pytest.mark.postgres
+def test_sql_sm2_matches_python_exactly(db_engine):
+    reviewed_at = datetime(2026, 3, 29, 0, 30, 12, 345678, tzinfo=timezone.utc)
+
+    with db_engine.connect() as conn:
+        for repetition, interval, ease, quality in itertools.product(
+            [0, 1, 2, 3, 7], [0, 1, 6, 37, 1234], [1.3, 1.7, 2.36, 2.5, 2.1799999999999997], range(6)
+        ):
+            expected = sm2_update(repetition, interval, ease, quality, reviewed_at)
+            exprs = sm2_update_sql(
+                literal(repetition), literal(interval), literal(ease), literal(quality, Integer),
+                literal(reviewed_at, DateTime(timezone=True)),
+            )
+            got = conn.execute(select(*[expr.label(name) for name, expr in exprs.items()])).one()._mapping
+            assert dict(got) == expected
+
+
+@pytest.mark.parametrize("write_path", ["cte", "orm"])
+def test_review_paths_reject_double_review(client, monkeypatch, write_path):
+    monkeypatch.setattr(review, "REVIEW_WRITE_PATH", write_path)
+    headers, card_id = setup_learned_card(client, f"review-{write_path}@test.com")
+
+    first = client.post(f"/cards/{card_id}/review", json={"quality": 4}, headers=headers)
+    assert first.status_code == 200
+
+    second = client.post(f"/cards/{card_id}/review", json={"quality": 4}, headers=headers)
+    assert second.status_code == 409
+
+    missing = client.post("/cards/999999/review", json={"quality": 4}, headers=headers)
+    assert missing.status_code == 404
+
+
+@pytest.mark.postgres
+def test_concurrent_reviews_write_one_history_row(committed_client, db_engine):
+    client = committed_client
+    headers, card_id = setup_learned_card(client, "review-race@test.com")
+
+    def submit(_):
+        return client.post(f"/cards/{card_id}/review", json={"quality": 5}, headers=headers).status_code
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        codes = sorted(pool.map(submit, range(4)))
+    assert codes == [200, 409, 409, 409]
+
+    with db_engine.connect() as conn:
+        rows = conn.execute(select(ReviewHistory.id).where(ReviewHistory.card_id == card_id)).all()
+    assert len(rows) == 1
+
+
+def history_rows(db_engine, card_id):
+    with db_engine.connect() as conn:
+        return conn.execute(select(ReviewHistory).where(ReviewHistory.card_id == card_id)).all()
+
+
+@pytest.mark.parametrize("write_path", ["cte", "orm"])
+def test_async_history_is_written_behind_and_flushed_on_close(committed_client, db_engine, monkeypatch, write_path):
+    client = committed_client
+    monkeypatch.setattr(review, "REVIEW_WRITE_PATH", write_path)
+    # Thresholds out of reach, only close() flushes
+    buffer = HistoryBuffer(db_engine, "async", max_rows=1000, interval=60)
+    monkeypatch.setattr(main, "history_buffer", buffer)
+    headers, card_id = setup_learned_card(client, f"buffer-{write_path}@test.com")
+
+    assert client.post(f"/cards/{card_id}/review", json={"quality": 3}, headers=headers).status_code == 200
+    assert history_rows(db_engine, card_id) == []
+    assert buffer.metrics()["depth"] == 1
+
+    # A row whose card is gone is dropped without losing the rest of the batch
+    buffer.add({**buffer._rows[0], "card_id": 999999})
+
+    buffer.close()
+    [row] = history_rows(db_engine, card_id)
+    assert (row.quality, row.repetition_before, row.repetition_after) == (3, 0, 1)
+
+    metrics = buffer.metrics()
+    assert (metrics["depth"], metrics["rows_flushed"], metrics["rows_dropped"]) == (0, 1, 1)
+
+
+def test_group_commit_history_is_durable_before_the_response(committed_client, db_engine, monkeypatch):
+    client = committed_client
+    buffer = HistoryBuffer(db_engine, "group", interval=0.01)
+    monkeypatch.setattr(main, "history_buffer", buffer)
+    headers, card_id = setup_learned_card(client, "buffer-group@test.com")
+
+    assert client.post(f"/cards/{card_id}/review", json={"quality": 4}, headers=headers).status_code == 200
+    assert len(history_rows(db_engine, card_id)) == 1
+    assert client.get("/ready").json()["history_buffer"]["flushes"] == 1
+    buffer.close()
+
+
+def test_group_commit_reports_history_that_was_not_written(committed_client, db_engine, monkeypatch):
+    client = committed_client
+    buffer = HistoryBuffer(db_engine, "group", interval=0.01)
+    headers, card_id = setup_learned_card(client, "buffer-group-fail@test.com")
+
+    # A row that can't be inserted fails its own review only
+    with pytest.raises(HistoryWriteError):
+        buffer.add({"card_id": 999999, "quality": 3})
+
+    # A flush that never finishes fails the review instead of hanging it
+    monkeypatch.setattr(history_buffer, "FLUSH_WAIT_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(main, "history_buffer", buffer)
+    with buffer._flush_lock:
+        response = client.post(f"/cards/{card_id}/review", json={"quality": 4}, headers=headers)
+    assert response.status_code == 503
+    buffer.close()
@@ -1,3 +1,8 @@
+import pytest
+
+from app.serve import worker_pool_size
+
+
 def test_health(client):
     res = client.get("/health")
     assert res.status_code == 200
@@ -5,4 +10,24 @@ def test_health(client):
 
 def test_me_requires_auth(client):
     res = client.get("/me")
-    assert res.status_code == 401
\ No newline at end of file
+    assert res.status_code == 401
+
+def test_ready_fails_while_draining(client):
+    res = client.get("/ready")
+    assert res.status_code == 200
+    assert res.json()["database"] == "ok"
+
+    client.app.state.draining = True
+    try:
+        assert client.get("/ready").status_code == 503
+    finally:
+        client.app.state.draining = False
+
+def test_worker_pools_fit_the_connection_budget():
+    # Two connections per worker go to the database rate limiter's own pool
+    assert worker_pool_size(20, 4, reserved_per_worker=2) == 3
+    assert worker_pool_size(20, 3) == 6
+    with pytest.raises(ValueError):
+        worker_pool_size(10, 4, reserved_per_worker=2)
+    with pytest.raises(ValueError):
+        worker_pool_size(2, 3)
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone, UTC
+
+import pytest
+from sqlalchemy import select, insert
+from sqlalchemy.exc import OperationalError
+
+from app.database import Base, create_db_engine
+from app.dialects import utcnow
+from app.models import User
+
+
+@pytest.fixture()
+def file_engine(tmp_path):
+    # Short busy timeout so lock contention fails fast instead of waiting
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'app.db'}", connect_args={"timeout": 0.1})
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+def test_connections_use_wal_and_foreign_keys(file_engine):
+    with file_engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA foreign_keys").scalar() == 1
+
+
+def test_timestamps_round_trip_as_aware_utc(file_engine):
+    deleted_at = datetime(2026, 3, 29, 2, 30, tzinfo=timezone(timedelta(hours=2)))
+
+    with file_engine.begin() as conn:
+        conn.execute(insert(User).values(email="tz@test.com", password_hash="x", deleted_at=deleted_at))
+        stored, now = conn.execute(select(User.deleted_at, utcnow()).where(User.email == "tz@test.com")).one()
+
+    assert stored == deleted_at
+    assert stored.tzinfo == UTC
+    assert abs(now - datetime.now(UTC)) < timedelta(seconds=5)
+
+
+def test_write_sessions_take_the_write_lock_up_front(file_engine):
+    writer = file_engine.execution_options(sqlite_begin="IMMEDIATE")
+
+    with writer.begin():
+        # Plain reads still go through under WAL
+        with file_engine.connect() as reader:
+            reader.execute(select(User.id)).all()
+
+        # A second writer is refused at BEGIN, before it could read stale rows
+        with pytest.raises(OperationalError, match="locked"):
+            with writer.begin():
+                pass
@@ -0,0 +1,75 @@
+from sqlalchemy import delete
+
+from app.models import DailyReviewStats
+from app.stats import backfill
+
+
+def setup_user_deck(client, email):
+    client.post("/signup", json={"email": email, "password": "password123"})
+    token = client.post("/login", json={"email": email, "password": "password123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    deck_id = client.post("/decks", json={"name": "Stats"}, headers=headers).json()["id"]
+    return headers, deck_id
+
+
+def learn_and_review(client, headers, deck_id, qualities):
+    for quality in qualities:
+        card = client.post(f"/decks/{deck_id}/cards", json={"front": "Q", "back": "A"}, headers=headers).json()
+        client.post(f"/cards/{card['id']}/learn", headers=headers)
+        client.post(f"/cards/{card['id']}/review", json={"quality": quality}, headers=headers)
+
+
+def test_review_and_learn_update_daily_rollups(client):
+    headers, deck_id = setup_user_deck(client, "stats@test.com")
+    learn_and_review(client, headers, deck_id, [5, 1, 2])
+
+    res = client.get(f"/decks/{deck_id}/stats", headers=headers)
+    assert res.status_code == 200
+    days = res.json()
+    assert len(days) == 1
+    assert days[0]["reviews"] == 3
+    assert days[0]["failures"] == 2
+    assert days[0]["new_cards"] == 3
+
+    # Account-wide stats sum across decks
+    other_deck = client.post("/decks", json={"name": "Other"}, headers=headers).json()["id"]
+    learn_and_review(client, headers, other_deck, [4])
+    total = client.get("/me/stats", headers=headers).json()
+    assert total[0]["reviews"] == 4
+    assert total[0]["new_cards"] == 4
+
+
+def test_backfill_rebuilds_rollups_from_history(committed_client, db_engine):
+    client = committed_client
+    headers, deck_id = setup_user_deck(client, "stats-backfill@test.com")
+    learn_and_review(client, headers, deck_id, [3, 0])
+    before = client.get(f"/decks/{deck_id}/stats", headers=headers).json()
+
+    with db_engine.begin() as conn:
+        conn.execute(delete(DailyReviewStats).where(DailyReviewStats.deck_id == deck_id))
+    assert client.get(f"/decks/{deck_id}/stats", headers=headers).json() == []
+
+    backfill(db_engine)
+    assert client.get(f"/decks/{deck_id}/stats", headers=headers).json() == before
+
+
+def test_stats_rejects_inverted_range(client):
+    headers, _ = setup_user_deck(client, "stats-range@test.com")
+
+    res = client.get("/me/stats?start=2026-02-01&end=2026-01-01", headers=headers)
+    assert res.status_code == 422
+
+
+def test_backfill_skips_schedules_carried_by_clone(committed_client, db_engine):
+    client = committed_client
+    headers, deck_id = setup_user_deck(client, "stats-carry@test.com")
+    learn_and_review(client, headers, deck_id, [4, 5, 3])
+    client.post(f"/decks/{deck_id}/clone", json={"schedule": "carry"}, headers=headers)
+    before = client.get("/me/stats", headers=headers).json()
+    assert before[0]["new_cards"] == 3
+
+    with db_engine.begin() as conn:
+        conn.execute(delete(DailyReviewStats))
+
+    backfill(db_engine)
+    assert client.get("/me/stats", headers=headers).json() == before
@@ -0,0 +1,83 @@
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app.main import limiter
+from app.ratelimit import MemoryBackend
+
+
+def setup_deck(client, email="study@test.com"):
+    client.post("/signup", json={"email": email, "password": "password123"})
+    token = client.post("/login", json={"email": email, "password": "password123"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    deck_id = client.post("/decks", json={"name": "Study"}, headers=headers).json()["id"]
+    card_ids = [
+        client.post(f"/decks/{deck_id}/cards", json={"front": front, "back": "B"}, headers=headers).json()["id"]
+        for front in ("Due", "New", "Later")
+    ]
+    client.post(f"/cards/{card_ids[0]}/learn", headers=headers)
+    return token, headers, deck_id, card_ids
+
+
+def test_study_socket_serves_due_then_new_cards(client):
+    token, headers, deck_id, (due_id, new_id, _) = setup_deck(client)
+
+    with client.websocket_connect(f"/ws/study/{deck_id}?token={token}&new_limit=1") as ws:
+        first = ws.receive_json()
+        assert (first["kind"], first["card"]["id"]) == ("due", due_id)
+
+        # Only the current card can be graded
+        ws.send_json({"card_id": new_id, "quality": 4})
+        assert ws.receive_json()["status"] == 409
+
+        ws.send_json({"card_id": due_id, "quality": 4})
+        reviewed = ws.receive_json()
+        assert (reviewed["type"], reviewed["card_id"], reviewed["interval_days"]) == ("reviewed", due_id, 0)
+
+        second = ws.receive_json()
+        assert (second["kind"], second["card"]["id"]) == ("new", new_id)
+
+        # New cards are learned and reviewed in one step
+        ws.send_json({"card_id": new_id, "quality": 5})
+        assert ws.receive_json()["type"] == "reviewed"
+
+        # new_limit=1 holds back the third card
+        assert ws.receive_json() == {"type": "done"}
+
+    for card_id in (due_id, new_id):
+        history = client.get(f"/cards/{card_id}/history", headers=headers).json()
+        assert len(history["reviews"]) == 1
+
+    # No leases are left behind for other devices
+    claimed = client.post(f"/decks/{deck_id}/cards/due/claim", headers={**headers, "X-Device-Id": "phone"})
+    assert claimed.status_code == 200
+
+
+def test_study_socket_requires_token_and_owned_deck(client):
+    token, _, deck_id, _ = setup_deck(client)
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(f"/ws/study/{deck_id}") as ws:
+            ws.receive_json()
+
+    other_token, _, _, _ = setup_deck(client, "study-other@test.com")
+    with client.websocket_connect(f"/ws/study/{deck_id}?token={other_token}") as ws:
+        assert ws.receive_json() == {"type": "error", "status": 404, "detail": "Deck not found"}
+
+
+def test_study_socket_grades_spend_the_review_bucket(client, monkeypatch):
+    monkeypatch.setattr(limiter, "enabled", True)
+    monkeypatch.setattr(limiter, "backend", MemoryBackend())
+    monkeypatch.setattr(limiter, "limits", {**limiter.limits, "review": (1, 0.01)})
+    token, _, deck_id, (due_id, new_id, _) = setup_deck(client, "study-limited@test.com")
+
+    with client.websocket_connect(f"/ws/study/{deck_id}?token={token}&new_limit=1") as ws:
+        assert ws.receive_json()["card"]["id"] == due_id
+        ws.send_json({"card_id": due_id, "quality": 4})
+        assert ws.receive_json()["type"] == "reviewed"
+        assert ws.receive_json()["card"]["id"] == new_id
+
+        # The bucket is empty, the card stays current until a grade gets through
+        ws.send_json({"card_id": new_id, "quality": 4})
+        blocked = ws.receive_json()
+        assert (blocked["status"], blocked["retry_after"] >= 1) == (429, True)
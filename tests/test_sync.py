@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, UTC
+import time
+
+import pytest
+from sqlalchemy import select, update
+
+from app import changelog
+from app.models import ChangeLog, CardSchedule, User
+
+
+def auth_headers(client, email="sync@test.com"):
+    client.post("/signup", json={
+        "email": email,
+        "password": "password123"
+    })
+    login = client.post("/login", json={
+        "email": email,
+        "password": "password123"
+    })
+    token = login.json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_sync_from_zero_returns_full_state(client):
+    headers = auth_headers(client)
+
+    deck = client.post("/decks", json={"name": "Synced"}, headers=headers).json()
+    card = client.post(
+        f"/decks/{deck['id']}/cards",
+        json={"front": "S", "back": "Y"},
+        headers=headers
+    ).json()
+    client.post(f"/cards/{card['id']}/learn", headers=headers)
+
+    res = client.get("/sync?since=0", headers=headers)
+    assert res.status_code == 200
+    data = res.json()
+    assert data["reset"] is False
+    assert data["has_more"] is False
+    assert [d["id"] for d in data["decks"]] == [deck["id"]]
+    assert [c["id"] for c in data["cards"]] == [card["id"]]
+    assert data["cards"][0]["is_learned"] is True
+    assert [s["card_id"] for s in data["schedules"]] == [card["id"]]
+
+
+def test_sync_delta_only_returns_changes_since_cursor(client):
+    headers = auth_headers(client, "sync-delta@test.com")
+
+    deck = client.post("/decks", json={"name": "Delta"}, headers=headers).json()
+    keep = client.post(f"/decks/{deck['id']}/cards", json={"front": "K", "back": "K"}, headers=headers).json()
+    drop = client.post(f"/decks/{deck['id']}/cards", json={"front": "D", "back": "D"}, headers=headers).json()
+
+    cursor = client.get("/sync?since=0", headers=headers).json()["cursor"]
+
+    client.patch(f"/cards/{keep['id']}", json={"front": "K2"}, headers=headers)
+    client.delete(f"/cards/{drop['id']}", headers=headers)
+
+    data = client.get(f"/sync?since={cursor}", headers=headers).json()
+    assert data["decks"] == []
+    assert [c["front"] for c in data["cards"]] == ["K2"]
+    assert data["deleted_cards"] == [drop["id"]]
+    assert data["cursor"] > cursor
+
+    # Nothing new after the latest cursor
+    empty = client.get(f"/sync?since={data['cursor']}", headers=headers).json()
+    assert empty["cards"] == [] and empty["deleted_cards"] == []
+
+
+def test_sync_pages_with_cursor(client):
+    headers = auth_headers(client, "sync-page@test.com")
+
+    for i in range(3):
+        client.post("/decks", json={"name": f"P{i}"}, headers=headers)
+
+    first = client.get("/sync?since=0&limit=2", headers=headers).json()
+    assert len(first["decks"]) == 2
+    assert first["has_more"] is True
+
+    second = client.get(f"/sync?since={first['cursor']}&limit=2", headers=headers).json()
+    assert len(second["decks"]) == 1
+    assert second["has_more"] is False
+
+
+def test_superseded_entries_and_old_tombstones_are_compacted(committed_client, db_engine):
+    client = committed_client
+    headers = auth_headers(client, "sync-compact@test.com")
+
+    deck = client.post("/decks", json={"name": "Compact"}, headers=headers).json()
+    card = client.post(f"/decks/{deck['id']}/cards", json={"front": "A", "back": "B"}, headers=headers).json()
+    for i in range(3):
+        client.patch(f"/cards/{card['id']}", json={"back": f"B{i}"}, headers=headers)
+
+    # Deleting the deck leaves one tombstone and drops its card entries
+    client.delete(f"/decks/{deck['id']}", headers=headers)
+    data = client.get("/sync?since=0", headers=headers).json()
+    assert data["deleted_decks"] == [deck["id"]]
+    assert data["cards"] == [] and data["deleted_cards"] == []
+
+    # Age the tombstone past retention, the next delete compacts it and raises the floor
+    with db_engine.begin() as conn:
+        conn.execute(
+            update(ChangeLog)
+            .where(ChangeLog.entity == changelog.ENTITY_DECK, ChangeLog.entity_id == deck["id"])
+            .values(created_at=datetime.now(UTC) - changelog.TOMBSTONE_RETENTION - timedelta(days=1))
+        )
+
+    other = client.post("/decks", json={"name": "Other"}, headers=headers).json()
+    client.delete(f"/decks/{other['id']}", headers=headers)
+
+    stale = client.get("/sync?since=1", headers=headers).json()
+    assert stale["reset"] is True
+
+    # A full resync is still served
+    full = client.get("/sync?since=0", headers=headers).json()
+    assert full["reset"] is False
+    assert full["deleted_decks"] == [other["id"]]
+
+
+@pytest.mark.postgres
+def test_delete_during_review_takes_locks_in_review_order(committed_client, db_engine):
+    client = committed_client
+    headers = auth_headers(client, "sync-lock-order@test.com")
+    user_id = client.get("/me", headers=headers).json()["user_id"]
+    deck = client.post("/decks", json={"name": "Locks"}, headers=headers).json()
+    card = client.post(f"/decks/{deck['id']}/cards", json={"front": "L", "back": "O"}, headers=headers).json()
+    client.post(f"/cards/{card['id']}/learn", headers=headers)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # A review in progress: schedule locked first, the change log's users update comes next
+        with db_engine.begin() as review:
+            review.execute(select(CardSchedule).where(CardSchedule.card_id == card["id"]).with_for_update())
+            deleting = pool.submit(client.delete, f"/cards/{card['id']}", headers=headers)
+            time.sleep(0.3)
+
+            # The delete waits on the schedule without holding the users row, so no deadlock
+            review.execute(update(User).where(User.id == user_id).values(change_seq=User.change_seq + 1))
+
+        assert deleting.result().status_code == 204
@@ -0,0 +1,62 @@
+import pytest
+from sqlalchemy import inspect, text
+
+from app.config import TEST_DATABASE_URL
+from app.database import Base, create_db_engine
+from app.upgrade import upgrade_schema
+
+
+# Tables as the first release created them
+BASELINE_DDL = [
+    "CREATE TABLE users (id SERIAL PRIMARY KEY, email VARCHAR NOT NULL UNIQUE, password_hash VARCHAR NOT NULL)",
+    "CREATE TABLE decks (id SERIAL PRIMARY KEY, name VARCHAR NOT NULL, user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE)",
+    "CREATE INDEX ix_decks_user_id ON decks (user_id)",
+    "CREATE TABLE cards (id SERIAL PRIMARY KEY, front VARCHAR NOT NULL, back VARCHAR NOT NULL, "
+    "deck_id INTEGER NOT NULL REFERENCES decks (id) ON DELETE CASCADE, is_learned BOOLEAN NOT NULL)",
+    "CREATE TABLE card_schedules (card_id INTEGER PRIMARY KEY REFERENCES cards (id) ON DELETE CASCADE, "
+    "deck_id INTEGER NOT NULL REFERENCES decks (id) ON DELETE CASCADE, repetition_count INTEGER NOT NULL, "
+    "interval_days INTEGER NOT NULL, ease_factor FLOAT NOT NULL, next_review_at TIMESTAMPTZ NOT NULL, "
+    "last_reviewed_at TIMESTAMPTZ, created_at TIMESTAMPTZ NOT NULL DEFAULT now(), updated_at TIMESTAMPTZ NOT NULL DEFAULT now())",
+    "CREATE TABLE review_history (id SERIAL PRIMARY KEY, card_id INTEGER NOT NULL REFERENCES cards (id) ON DELETE CASCADE, "
+    "reviewed_at TIMESTAMPTZ NOT NULL DEFAULT now(), quality INTEGER NOT NULL, repetition_before INTEGER NOT NULL, "
+    "interval_before INTEGER NOT NULL, ease_before FLOAT NOT NULL, repetition_after INTEGER NOT NULL, "
+    "interval_after INTEGER NOT NULL, ease_after FLOAT NOT NULL, next_review_at_after TIMESTAMPTZ NOT NULL)",
+]
+
+
+@pytest.fixture()
+def baseline_engine(db_engine):
+    with db_engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA IF EXISTS upgrade_test CASCADE"))
+        conn.execute(text("CREATE SCHEMA upgrade_test"))
+
+    engine = create_db_engine(TEST_DATABASE_URL, connect_args={"options": "-csearch_path=upgrade_test"})
+    with engine.begin() as conn:
+        for ddl in BASELINE_DDL:
+            conn.exec_driver_sql(ddl)
+        conn.execute(text("INSERT INTO users (email, password_hash) VALUES ('old@test.com', 'x')"))
+    yield engine
+
+    engine.dispose()
+    with db_engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA upgrade_test CASCADE"))
+
+
+@pytest.mark.postgres
+def test_upgrade_brings_baseline_schema_up_to_the_models(baseline_engine):
+    assert upgrade_schema(baseline_engine)
+
+    inspector = inspect(baseline_engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        assert {column.name for column in table.columns} <= columns
+    assert "search_vector" in {column["name"] for column in inspector.get_columns("cards")}
+
+    # Existing rows get the defaults, and a soft-deleted account frees its email
+    with baseline_engine.begin() as conn:
+        assert conn.execute(text("SELECT change_seq FROM users WHERE email = 'old@test.com'")).scalar_one() == 0
+        conn.execute(text("UPDATE users SET deleted_at = now() WHERE email = 'old@test.com'"))
+        conn.execute(text("INSERT INTO users (email, password_hash) VALUES ('old@test.com', 'y')"))
+
+    # Nothing left to do on a second run
+    assert upgrade_schema(baseline_engine) == []